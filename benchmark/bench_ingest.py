@@ -0,0 +1,122 @@
+"""
+导入流程各个环节的性能测试, 使用合成的通达信数据和除权除息表
+
+python benchmark/bench_ingest.py --symbols 200 --years 10 --events 10
+
+需要安装 zipline 和 cn_stock_holidays, 代码列表和除权除息表使用合成数据,
+不需要 squant 和真实的数据文件
+"""
+import os
+import shutil
+import tempfile
+
+import click
+
+from cn_stock_holidays.zipline.default_calendar import shsz_calendar
+
+from fixtures import make_fixture_tree, synthetic_symbol_list, write_cqcx_placeholders
+from measure import measure, format_row, max_rss_mb
+from zipline_cn_databundle import squant_source
+from zipline_cn_databundle.ingest_report import bars_nbytes
+from zipline_cn_databundle.tdx.reader import TdxReader
+
+
+def session_bounds(calendar, codes, tdx_reader):
+    exchange, code = codes[0]
+    dates = tdx_reader.get_df(code, exchange).index
+    sessions = calendar.all_sessions
+    start = sessions[sessions.searchsorted(dates[0].tz_localize('UTC'))]
+    end = sessions[sessions.searchsorted(dates[-1].tz_localize('UTC'), side='right') - 1]
+    return start, end
+
+
+def run_ingest(bundle, calendar_name, start_session, end_session, zipline_root):
+    from zipline.data.bundles import register, ingest, unregister
+
+    name = 'bench_squant'
+    register(name, bundle, calendar_name, start_session, end_session)
+    try:
+        ingest(name, environ={'ZIPLINE_ROOT': zipline_root}, show_progress=False)
+    finally:
+        unregister(name)
+
+
+@click.command()
+@click.option('--symbols', default=200, help='number of synthetic symbols')
+@click.option('--years', default=10, help='years of daily history per symbol')
+@click.option('--events', default=10, help='split/dividend events per symbol')
+@click.option('--repeat', default=1, help='best of N runs')
+@click.option('--ingest/--no-ingest', default=True, help='run a full bundle ingest into a temp ZIPLINE_ROOT')
+def main(symbols, years, events, repeat, ingest):
+    root = tempfile.mkdtemp(prefix='squant_bench_')
+    try:
+        codes, vipdoc, cqcx = make_fixture_tree(root, symbols, years, events)
+        cqcx_paths, cqcx_parser = write_cqcx_placeholders(root, cqcx)
+        symbol_df = synthetic_symbol_list(codes)
+        bundle = squant_source.make_squant_bundle(
+            tdx_dir=vipdoc,
+            cqcx=cqcx_paths,
+            symbol_list=symbol_df.copy,
+            cqcx_parser=cqcx_parser,
+            cqcx_cache='',
+        )
+        compact_bundle = squant_source.make_squant_bundle(
+            tdx_dir=vipdoc,
+            cqcx=cqcx_paths,
+            symbol_list=symbol_df.copy,
+            cqcx_parser=cqcx_parser,
+            cqcx_cache='',
+            compact='1',
+        )
+
+        tdx_reader = TdxReader(vipdoc)
+        start_session, end_session = session_bounds(shsz_calendar, codes, tdx_reader)
+        symbol_map = symbol_df.simplesymbol
+        day_bytes = sum(os.path.getsize(tdx_reader.get_filename(c, e)) for e, c in codes)
+        day_rows = day_bytes // 32
+        cqcx_data = [cqcx['sh'], cqcx['sz']]
+        cqcx_rows = sum(len(t) for t in cqcx_data)
+        n_sessions = len(shsz_calendar.sessions_in_range(start_session, end_session))
+
+        click.echo('%d symbols, %d day records (%.1f MB), %d cqcx records, %d sessions' % (
+            len(codes), day_rows, day_bytes / 1e6, cqcx_rows, n_sessions))
+
+        elapsed, peak, _ = measure(lambda: [tdx_reader.get_df(c, e) for e, c in codes], repeat)
+        click.echo(format_row('TdxReader.get_df', elapsed, peak, day_rows, day_bytes))
+
+        bar_bytes = {}
+        for compact in (False, True):
+            def consume_hist_data():
+                nbytes = 0
+                for sid, history in squant_source.get_hist_data(symbol_df, symbol_map, tdx_reader,
+                                                                start_session, end_session, shsz_calendar,
+                                                                compact=compact):
+                    nbytes += bars_nbytes(history)
+                return nbytes
+            elapsed, peak, bar_bytes[compact] = measure(consume_hist_data, repeat)
+            name = 'get_hist_data compact' if compact else 'get_hist_data'
+            click.echo(format_row(name, elapsed, peak, n_sessions * len(codes), day_bytes))
+        click.echo('bars handed to writer: %.1f MB float64, %.1f MB compact (%.0f%% saved)' % (
+            bar_bytes[False] / 1e6, bar_bytes[True] / 1e6, 100.0 * (1 - bar_bytes[True] / bar_bytes[False])))
+
+        elapsed, peak, _ = measure(
+            lambda: squant_source.zipline_splits_and_dividends(symbol_map, cqcx_data), repeat,
+        )
+        click.echo(format_row('zipline_splits_and_dividends', elapsed, peak, cqcx_rows))
+
+        if ingest:
+            zipline_root = os.path.join(root, 'zipline')
+            for compact, bundle in ((False, bundle), (True, compact_bundle)):
+                elapsed, peak, _ = measure(
+                    lambda: run_ingest(bundle, 'SHSZ', start_session, end_session, zipline_root), repeat,
+                )
+                name = 'squant_bundle ingest compact' if compact else 'squant_bundle ingest'
+                click.echo(format_row(name, elapsed, peak, n_sessions * len(codes), day_bytes))
+
+        click.echo('max rss: %.1f MB' % max_rss_mb())
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+对比 TdxReader.get_df (numpy 向量化) 与 get_df_by_rows (逐行解析) 的性能
+
+python benchmark/bench_tdx_reader.py --symbols 50 --years 20
+"""
+import shutil
+import tempfile
+import timeit
+
+import click
+
+from fixtures import make_vipdoc
+from zipline_cn_databundle.tdx.reader import TdxReader
+
+
+@click.command()
+@click.option('--symbols', default=50, help='number of synthetic symbols')
+@click.option('--years', default=20, help='years of daily history per symbol')
+@click.option('--repeat', default=3, help='best of N runs')
+def main(symbols, years, repeat):
+    root = tempfile.mkdtemp(prefix='tdx_bench_')
+    try:
+        codes = make_vipdoc(root, symbols, years)
+        reader = TdxReader(root)
+
+        exchange, code = codes[0]
+        fast, slow = reader.get_df(code, exchange), reader.get_df_by_rows(code, exchange)
+        if not fast.equals(slow):
+            raise AssertionError('get_df and get_df_by_rows differ for %s%s' % (exchange, code))
+
+        rows = len(fast) * len(codes)
+        results = {}
+        for name in ('get_df_by_rows', 'get_df'):
+            method = getattr(reader, name)
+            elapsed = min(timeit.repeat(
+                lambda: [method(c, e) for e, c in codes],
+                number=1,
+                repeat=repeat,
+            ))
+            results[name] = elapsed
+            click.echo('%-16s %8.3fs  %12.0f rows/s' % (name, elapsed, rows / elapsed))
+
+        click.echo('speedup: %.1fx' % (results['get_df_by_rows'] / results['get_df']))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
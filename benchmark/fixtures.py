@@ -0,0 +1,145 @@
+"""
+生成用于性能测试的合成通达信数据
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from zipline_cn_databundle.tdx.reader import TDX_DAY_DTYPE
+
+
+def synthetic_day_records(n_rows, start='1995-01-03', seed=0):
+    """
+    生成 n_rows 条随机游走的日线记录 (TDX_DAY_DTYPE)
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.bdate_range(start, periods=n_rows)
+
+    close = np.maximum(1000 * np.exp(np.cumsum(rng.normal(0, 0.02, n_rows))), 1).astype(np.int32)
+    open_ = np.maximum(close + rng.randint(-20, 21, n_rows), 1)
+    high = np.maximum(np.maximum(open_, close) + rng.randint(0, 30, n_rows), 1)
+    low = np.maximum(np.minimum(open_, close) - rng.randint(0, 30, n_rows), 1)
+    volume = rng.randint(1000, 10000000, n_rows)
+
+    records = np.zeros(n_rows, dtype=TDX_DAY_DTYPE)
+    records['date'] = dates.year * 10000 + dates.month * 100 + dates.day
+    records['open'] = open_
+    records['high'] = high
+    records['low'] = low
+    records['close'] = close
+    records['volume'] = volume
+    records['amount'] = volume * close * 0.01
+    return records
+
+
+def write_day_file(path, records):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    records.tofile(path)
+    return path
+
+
+def synthetic_code(i):
+    """
+    第 i 个合成代码, 偶数在上海, 奇数在深圳
+    """
+    if i % 2 == 0:
+        return 'sh', str(600000 + i // 2).zfill(6)
+    return 'sz', str(1 + i // 2).zfill(6)
+
+
+def make_vipdoc(root, n_symbols, years, seed=0):
+    """
+    在 root 下生成 vipdoc/{sh,sz}/lday 目录结构
+    :return: [(exchange, code), ...]
+    """
+    n_rows = int(years * 250)
+    codes = []
+    for i in range(n_symbols):
+        exchange, code = synthetic_code(i)
+        path = os.path.join(root, exchange, 'lday', '%s%s.day' % (exchange, code))
+        write_day_file(path, synthetic_day_records(n_rows, seed=seed + i))
+        codes.append((exchange, code))
+    return codes
+
+
+# 与 squant file_parser.get_cqcx 返回的记录字段相同
+CQCX_DTYPE = np.dtype([
+    ('stock', '<i4'),
+    ('date', '<i4'),
+    ('sgVal', '<f8'),
+    ('pxVal', '<f8'),
+    ('pgVal', '<f8'),
+    ('pgPrice', '<f8'),
+])
+
+
+def synthetic_cqcx(codes, events_per_symbol, start='1995-01-03', end='2016-12-30', seed=0):
+    """
+    生成除权除息记录, 每个代码 events_per_symbol 条, 大约一半送股一半派息
+    :param codes: [(exchange, code), ...]
+    """
+    rng = np.random.RandomState(seed)
+    n = len(codes) * events_per_symbol
+    dates = pd.DatetimeIndex(np.sort(rng.randint(
+        pd.Timestamp(start).value // 10 ** 9, pd.Timestamp(end).value // 10 ** 9, n
+    )) * 10 ** 9)
+
+    cqcx = np.zeros(n, dtype=CQCX_DTYPE)
+    cqcx['stock'] = np.repeat([int(code) for _, code in codes], events_per_symbol)
+    cqcx['date'] = dates.year * 10000 + dates.month * 100 + dates.day
+    kind = rng.randint(0, 3, n)
+    cqcx['sgVal'] = np.where(kind != 1, rng.randint(1, 10, n) * 100, 0)
+    cqcx['pxVal'] = np.where(kind != 0, rng.randint(1, 500, n), 0)
+    return cqcx
+
+
+def synthetic_symbol_list(codes, start='1995-01-03'):
+    """
+    与 squant get_symbol_list 格式相同的代码列表, 索引为 sid
+    """
+    exchanges = {'sh': ('SSE', 'SS'), 'sz': ('SZSE', 'SZ')}
+    rows = []
+    for exchange, code in codes:
+        name, suffix = exchanges[exchange]
+        rows.append({
+            'symbol': '%s.%s' % (code, suffix),
+            'simplesymbol': code,
+            'asset_name': 'SYN%s' % code,
+            'exchange': name,
+            'status': False,
+            'start_date': pd.Timestamp(start),
+            'end_date': pd.Timestamp('1900-01-01'),
+        })
+    return pd.DataFrame(data=rows)
+
+
+def make_fixture_tree(root, n_symbols, years, events_per_symbol=10, seed=0):
+    """
+    在 root 下生成 vipdoc 目录和沪深两个除权除息表
+    :return: (codes, vipdoc 目录, {'sh': cqcx, 'sz': cqcx})
+    """
+    vipdoc = os.path.join(root, 'vipdoc')
+    codes = make_vipdoc(vipdoc, n_symbols, years, seed=seed)
+    cqcx = {}
+    for exchange in ('sh', 'sz'):
+        cqcx[exchange] = synthetic_cqcx(
+            [c for c in codes if c[0] == exchange], events_per_symbol, seed=seed,
+        )
+    return codes, vipdoc, cqcx
+
+
+def write_cqcx_placeholders(root, cqcx):
+    """
+    squant 配置会检查除权除息文件是否存在, 生成空文件, 内容由 cqcx_parser 按路径返回
+    :return: ((沪市路径, 深市路径), cqcx_parser)
+    """
+    tables = {}
+    for exchange in ('sh', 'sz'):
+        path = os.path.join(root, 'CQCX_%s' % exchange.upper())
+        open(path, 'wb').close()
+        tables[path] = cqcx[exchange]
+    paths = (os.path.join(root, 'CQCX_SH'), os.path.join(root, 'CQCX_SZ'))
+    return paths, tables.__getitem__
@@ -0,0 +1,38 @@
+"""
+计时和内存统计
+"""
+import resource
+import time
+import tracemalloc
+
+
+def measure(func, repeat=1):
+    """
+    执行 func repeat 次
+    :return: (最短耗时秒数, 最大 python 内存分配字节数, 最后一次的返回值)
+    """
+    best, peak, result = None, 0, None
+    for _ in range(repeat):
+        tracemalloc.start()
+        try:
+            begin = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - begin
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, peak, result
+
+
+def max_rss_mb():
+    # linux 下单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def format_row(name, elapsed, peak, rows=None, nbytes=None):
+    parts = ['%-28s %9.3fs' % (name, elapsed)]
+    parts.append('%12s' % ('%.0f rows/s' % (rows / elapsed) if rows else ''))
+    parts.append('%12s' % ('%.1f MB/s' % (nbytes / elapsed / 1e6) if nbytes else ''))
+    parts.append('peak %8.1f MB' % (peak / 1e6))
+    return '  '.join(parts)
@@ -13,6 +13,10 @@ setup(
         'console_scripts': [
             'zipline-cn-databundle-update=zipline_cn_databundle:zipline_cn_databundle_update',
             'gen-all-index-benchmark-data=zipline_cn_databundle.index_list.__init__:gen_data',
+            'tdx-build-store=zipline_cn_databundle.tdx.columnar:build_store',
+            'tdx-validate=zipline_cn_databundle.tdx.validate:validate',
+            'squant-ingest-report=zipline_cn_databundle.ingest_report:ingest_report',
+            'squant-ingest-shard=zipline_cn_databundle.shard:ingest_shard_command',
         ]
     }
 )
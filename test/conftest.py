@@ -0,0 +1,182 @@
+"""
+pytest 配置
+
+test_cn_squant2_run*.py 是需要 zipline 和真实数据的回测脚本, 直接用 python 运行, 不由 pytest 收集;
+其他测试使用 benchmark/fixtures.py 生成的合成通达信数据, 以及代替 tushare 的本地 http 服务器
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmark'))
+
+from fixtures import make_fixture_tree, synthetic_symbol_list, write_cqcx_placeholders
+
+collect_ignore = ['test_cn_squant2_run.py', 'test_cn_squant2_run_text.py']
+
+# 合成日线从 1995-01-03 开始, 每年 250 条
+START_SESSION = pd.Timestamp('1995-02-01')
+END_SESSION = pd.Timestamp('1995-11-30')
+
+
+class WeekdayCalendar(object):
+    """
+    只实现 sessions_in_range 的交易日历, 所有工作日都是交易日
+    """
+
+    def sessions_in_range(self, start_session, end_session):
+        # 与 zipline 的交易日历相同, 使用纳秒精度的 UTC 时间
+        sessions = pd.bdate_range(start_session, end_session).values.astype('datetime64[ns]')
+        return pd.DatetimeIndex(sessions).tz_localize('UTC')
+
+
+class SyntheticTree(object):
+    """
+    make_fixture_tree 生成的数据, 以及与之对应的代码列表和除权除息解析函数
+    """
+
+    def __init__(self, root, n_symbols=6, years=1):
+        self.root = root
+        self.codes, self.vipdoc, self.cqcx = make_fixture_tree(root, n_symbols, years)
+        self.calendar = WeekdayCalendar()
+
+    def symbol_list(self):
+        return synthetic_symbol_list(self.codes)
+
+    def day_file(self, exchange, code):
+        return os.path.join(self.vipdoc, exchange, 'lday', '%s%s.day' % (exchange, code))
+
+    def cqcx_files(self):
+        """
+        :return: ((沪市路径, 深市路径), cqcx_parser), 见 fixtures.write_cqcx_placeholders
+        """
+        return write_cqcx_placeholders(self.root, self.cqcx)
+
+
+class RecordingWriter(object):
+    """
+    代替 zipline 的各个 writer, 记录写入的内容, 日线和分钟线的生成器在 write 中全部取出
+    """
+
+    def __init__(self):
+        self.data = None
+        self.kwargs = None
+
+    def write(self, data=None, show_progress=False, **kwargs):
+        if data is not None and not isinstance(data, pd.DataFrame):
+            data = list(data)
+        self.data = data
+        self.kwargs = kwargs
+
+
+class RecordingWriters(object):
+
+    def __init__(self):
+        self.asset_db_writer = RecordingWriter()
+        self.minute_bar_writer = RecordingWriter()
+        self.daily_bar_writer = RecordingWriter()
+        self.adjustment_writer = RecordingWriter()
+
+    def args(self):
+        """
+        :return: ingest_squant 的 writer 参数
+        """
+        return self.asset_db_writer, self.minute_bar_writer, self.daily_bar_writer, self.adjustment_writer
+
+
+@pytest.fixture
+def tree(tmpdir):
+    return SyntheticTree(str(tmpdir.mkdir('tree')))
+
+
+def synthetic_history(days, seed=0):
+    """
+    :return: tushare.get_hist_data 格式的 DataFrame, 日期从新到旧
+    """
+    rng = np.random.RandomState(seed)
+    index = pd.bdate_range('2017-01-02', periods=days)
+    close = np.round(10 + rng.randn(days).cumsum() * 0.1, 2)
+    history = pd.DataFrame({'open': close, 'high': close + 0.1, 'close': close, 'low': close - 0.1,
+                            'volume': rng.randint(100, 10000, days).astype(float)}, index=index)
+    history.index.name = 'date'
+    return history[::-1]
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    /hist/<symbol>.csv 返回 histories[symbol], 支持 start 参数;
+    没有的代码返回 404, failures[symbol] 为剩余的 500 次数
+    """
+    daemon_threads = True
+
+    def __init__(self, histories, failures=None, delay=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.histories = histories
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/hist/%%s.csv' % self.server_address[1]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        symbol = url.path.rsplit('/', 1)[-1][:-len('.csv')]
+        start = parse_qs(url.query).get('start', [None])[0]
+        with server.lock:
+            server.requests.append((symbol, start))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            failing = server.failures.get(symbol, 0)
+            if failing:
+                server.failures[symbol] = failing - 1
+        try:
+            time.sleep(server.delay)
+            if failing:
+                self.send_error(500)
+            elif symbol not in server.histories:
+                self.send_error(404)
+            else:
+                history = server.histories[symbol]
+                if start:
+                    history = history[history.index >= start]
+                body = history.to_csv().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    histories = dict(('%06d' % i, synthetic_history(30, seed=i)) for i in range(8))
+    server = StandInServer(histories)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
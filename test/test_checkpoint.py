@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import START_SESSION, END_SESSION
+from fixtures import synthetic_day_records, write_day_file
+from zipline_cn_databundle.checkpoint import IngestCheckpoint
+from zipline_cn_databundle.ingest_report import IngestReport
+from zipline_cn_databundle.squant_config import SquantConfig
+from zipline_cn_databundle.squant_source import load_symbols, open_tdx_reader, filter_symbols, get_tdx_hist_data
+
+
+def read_hist_data(tree, cache=None, limit=None, **options):
+    """
+    解析 tree 中的日线, limit 不为 None 时只取前 limit 个代码, 模拟导入中断
+    :return: ([(sid, bars)], report)
+    """
+    config = SquantConfig(environ={}, tdx_dir=tree.vipdoc, checkpoint=int(cache is not None), **options)
+    report = IngestReport()
+    tdx_reader, tdx_index = open_tdx_reader(config, report)
+    symbol_df, symbol_map = load_symbols(tree.symbol_list, START_SESSION, END_SESSION)
+    hist_symbol_map = filter_symbols(config, symbol_df, symbol_map, tdx_index, START_SESSION, END_SESSION)
+    hist_data = get_tdx_hist_data(config, symbol_df, hist_symbol_map, tdx_reader, START_SESSION, END_SESSION,
+                                  tree.calendar, report, cache=cache)
+    try:
+        return [item for _, item in zip(range(limit or len(hist_symbol_map)), hist_data)], report
+    finally:
+        hist_data.close()
+
+
+def assert_same_bars(left, right):
+    assert [sid for sid, _ in left] == [sid for sid, _ in right]
+    for (sid, a), (_, b) in zip(left, right):
+        if isinstance(a, np.ndarray):
+            np.testing.assert_array_equal(a, b)
+        else:
+            pd.testing.assert_frame_equal(a, b)
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+@pytest.mark.parametrize('compact', [0, 1])
+def test_resumed_ingest_matches_clean_run(tree, processes, compact):
+    cache = {}
+    partial, _ = read_hist_data(tree, cache, limit=3, processes=processes, compact=compact)
+    assert len(partial) == 3
+
+    # 两次导入之间更新了通达信数据: 已经在检查点中的第一个代码的文件被改写, 大小不变
+    exchange, code = tree.codes[partial[0][0]]
+    fname = tree.day_file(exchange, code)
+    size = os.path.getsize(fname)
+    write_day_file(fname, synthetic_day_records(size // 32, seed=100))
+    os.utime(fname, (1e9, 1e9))
+
+    resumed, report = read_hist_data(tree, cache, processes=processes, compact=compact)
+    clean, _ = read_hist_data(tree, processes=processes, compact=compact)
+
+    assert_same_bars(resumed, clean)
+    # 只有没有变化的两个代码从检查点读取
+    assert report.stages['checkpoint']['rows'] == 2
+
+
+def test_checkpoint_params_change_clears_cache():
+    cache = {}
+    checkpoint = IngestCheckpoint(cache, tdx_dir='/a', compact=False)
+    checkpoint.save(1, pd.DataFrame({'close': [1.0]}), source=(32, 1.0))
+    assert IngestCheckpoint(cache, tdx_dir='/a', compact=False).completed({1: (32, 1.0)}) == {1}
+
+    assert IngestCheckpoint(cache, tdx_dir='/a', compact=True).completed() == set()
+    assert list(cache) == ['squant_checkpoint']
+
+
+def test_checkpoint_drops_changed_and_unknown_sources():
+    cache = {}
+    checkpoint = IngestCheckpoint(cache, tdx_dir='/a')
+    for sid in range(3):
+        checkpoint.save(sid, pd.DataFrame({'close': [float(sid)]}), source=(32, 1.0))
+    checkpoint.save(3, pd.DataFrame({'close': [3.0]}))
+
+    assert checkpoint.completed({0: (32, 1.0), 1: (64, 2.0), 3: (32, 1.0)}) == {0}
+    assert checkpoint.completed() == {0}
+    assert sorted(cache) == ['squant_checkpoint', 'squant_daily_0', 'squant_source_0']
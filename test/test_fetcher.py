@@ -0,0 +1,96 @@
+"""
+HistoryFetcher 通过 HttpCsvTransport 请求本地的模拟服务器, 见 conftest.StandInServer
+"""
+import time
+
+import numpy as np
+
+from conftest import synthetic_history
+from zipline_cn_databundle.fetcher import FetchTimeout, HistoryFetcher, HttpCsvTransport
+from zipline_cn_databundle.history_cache import HistoryCache
+
+
+def assert_same_history(fetched, expected):
+    expected = expected.sort_index()
+    np.testing.assert_array_equal(fetched.index.values.astype('datetime64[D]'),
+                                  expected.index.values.astype('datetime64[D]'))
+    for field in ('open', 'high', 'close', 'low', 'volume'):
+        np.testing.assert_allclose(fetched[field].values, expected[field].values)
+
+
+def test_fetch_in_order_with_concurrent_requests(server):
+    server.delay = 0.05
+    fetcher = HistoryFetcher.from_environ({'TUSHARE_URL': server.url, 'TUSHARE_WORKERS': '4', 'TUSHARE_RATE': '0',
+                                           'TUSHARE_CACHE': ''})
+    symbols = sorted(server.histories) + ['missing']
+
+    results = list(fetcher.fetch(symbols))
+
+    assert [symbol for symbol, _ in results] == symbols
+    for symbol, history in results[:-1]:
+        assert_same_history(history.sort_index(), server.histories[symbol])
+    # 404 表示没有数据, 不是失败
+    assert results[-1][1] is None
+    assert fetcher.failures == {}
+    assert server.max_active > 1
+    # TUSHARE_CACHE 为空字符串时不使用缓存, 每次都完整下载
+    assert all(start is None for _, start in server.requests)
+
+
+def test_retry_with_backoff(server):
+    server.failures = {'000001': 2, '000002': 10}
+    sleeps = []
+    fetcher = HistoryFetcher(HttpCsvTransport(server.url), workers=2, rate=0, retries=2, backoff=0.5,
+                             sleep=sleeps.append)
+
+    results = dict(fetcher.fetch(['000001', '000002']))
+
+    assert_same_history(results['000001'].sort_index(), server.histories['000001'])
+    assert results['000002'] is None
+    assert list(fetcher.failures) == ['000002']
+    assert [symbol for symbol, _ in server.requests].count('000002') == 3
+    assert sorted(sleeps) == [0.5, 0.5, 1.0, 1.0]
+
+
+def test_cache_requests_from_last_cached_date(server, tmpdir):
+    now = [1e9]
+    cache = HistoryCache(str(tmpdir), max_age=3600, clock=lambda: now[0])
+    fetcher = HistoryFetcher(HttpCsvTransport(server.url), rate=0, cache=cache)
+    full = server.histories['000003']
+    server.histories['000003'] = full[5:]
+
+    assert_same_history(dict(fetcher.fetch(['000003']))['000003'], full[5:])
+    # 缓存在 max_age 内, 不请求服务器
+    now[0] += 60
+    list(fetcher.fetch(['000003']))
+    assert server.requests == [('000003', None)]
+
+    # 缓存的最后一天是盘中请求到的不完整日线, 之后被数据源修正
+    now[0] += 3600
+    full = full.copy()
+    full.iloc[5] = full.iloc[5] + 1.0
+    server.histories['000003'] = full
+    assert_same_history(dict(fetcher.fetch(['000003']))['000003'], full)
+    # 从缓存的最后日期开始请求
+    assert server.requests[-1] == ('000003', full.index[5].strftime('%Y-%m-%d'))
+
+
+def test_timeout_counts_as_failed_attempt():
+    # 与 TushareTransport 一样不使用 timeout 参数的 transport
+    calls = []
+
+    def transport(symbol, timeout, start=None):
+        calls.append(symbol)
+        if symbol == 'slow':
+            time.sleep(1.0)
+        return synthetic_history(5)
+
+    fetcher = HistoryFetcher(transport, workers=2, rate=0, retries=1, backoff=0, timeout=0.1, sleep=lambda _: None)
+    started = time.time()
+    results = dict(fetcher.fetch(['slow', 'fast']))
+
+    assert time.time() - started < 0.8
+    assert results['slow'] is None
+    assert_same_history(results['fast'].sort_index(), synthetic_history(5))
+    assert isinstance(fetcher.failures['slow'], FetchTimeout)
+    assert calls.count('slow') == 2
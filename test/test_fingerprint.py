@@ -0,0 +1,151 @@
+"""
+skip_unchanged 模式复制上次导入的日线, 上次的日线保存在内存中代替 bcolz, 结果与重新对齐全部记录相同
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from conftest import START_SESSION, END_SESSION
+from fixtures import synthetic_day_records, write_day_file
+from zipline_cn_databundle.align import SessionAligner
+from zipline_cn_databundle.fingerprint import DailyFingerprints, PreviousDailyBars
+from zipline_cn_databundle.ingest_report import IngestReport
+from zipline_cn_databundle.squant_config import SquantConfig
+from zipline_cn_databundle.squant_source import load_symbols, open_tdx_reader, filter_symbols, \
+    get_hist_data_reusing
+
+
+class MemoryDailyBars(object):
+    """
+    代替 PreviousDailyBars, 上次导入的日线保存在内存中
+    """
+    covers = PreviousDailyBars.covers
+
+    def __init__(self, fingerprints, hist_data):
+        self.fingerprints = fingerprints
+        self.bars = dict(hist_data)
+
+    def __contains__(self, sid):
+        return sid in self.bars
+
+    def get(self, sid):
+        return self.bars[sid].copy()
+
+
+def ingest_reusing(tree, end_session=END_SESSION, previous=None, processes=0):
+    """
+    :return: ([(sid, bars)], 这次导入的 MemoryDailyBars, report)
+    """
+    config = SquantConfig(environ={}, tdx_dir=tree.vipdoc)
+    report = IngestReport()
+    tdx_reader, tdx_index = open_tdx_reader(config, report)
+    symbol_df, symbol_map = load_symbols(tree.symbol_list, START_SESSION, end_session)
+    hist_symbol_map = filter_symbols(config, symbol_df, symbol_map, tdx_index, START_SESSION, end_session)
+    fingerprints = DailyFingerprints.for_sessions(tree.calendar.sessions_in_range(START_SESSION, end_session))
+    hist_data = list(get_hist_data_reusing(symbol_df, hist_symbol_map, tdx_reader, START_SESSION, end_session,
+                                           tree.calendar, previous, fingerprints, processes=processes,
+                                           report=report))
+    return hist_data, MemoryDailyBars(fingerprints, hist_data), report
+
+
+def assert_same_as_clean(tree, hist_data, end_session=END_SESSION):
+    clean, _, _ = ingest_reusing(tree, end_session)
+    assert [sid for sid, _ in hist_data] == [sid for sid, _ in clean]
+    for (_, a), (_, b) in zip(hist_data, clean):
+        np.testing.assert_array_equal(a, b)
+
+
+def reused_rows(report):
+    return report.stages.get('reused_bars', {}).get('rows', 0)
+
+
+def test_appended_records_are_read_from_previous_offset(tree):
+    # 导入区间固定, 通达信文件在区间结束前有追加
+    exchange, code = tree.codes[0]
+    fname = tree.day_file(exchange, code)
+    records = synthetic_day_records(200)
+    write_day_file(fname, records[:150])
+    _, previous, _ = ingest_reusing(tree)
+
+    write_day_file(fname, records)
+    hist_data, current, report = ingest_reusing(tree, previous=previous)
+
+    assert_same_as_clean(tree, hist_data)
+    assert reused_rows(report) == len(tree.codes) * len(previous.get(0))
+    # 只读取了追加的记录
+    entry = current.fingerprints.get(0, exchange + code)
+    assert entry['sha1'] is None
+    assert entry['rows'] == np.searchsorted(records['date'], 19951130, side='right')
+
+
+def test_changed_records_are_read_in_full(tree):
+    exchange, code = tree.codes[0]
+    fname = tree.day_file(exchange, code)
+    records = synthetic_day_records(200)
+    write_day_file(fname, records[:150])
+    _, previous, _ = ingest_reusing(tree)
+
+    # 上次的最后一条记录被删除后再追加, 之前的收盘价被修正
+    changed = np.concatenate([records[:149], records[150:]])
+    changed['close'][100] += 1
+    write_day_file(fname, changed)
+    hist_data, current, report = ingest_reusing(tree, previous=previous)
+
+    assert_same_as_clean(tree, hist_data)
+    assert reused_rows(report) == (len(tree.codes) - 1) * len(previous.get(0))
+    assert current.fingerprints.get(0, exchange + code)['sha1'] is not None
+
+    # 截断的文件同样重新读取
+    write_day_file(fname, records[:100])
+    hist_data, _, report = ingest_reusing(tree, previous=current)
+    assert_same_as_clean(tree, hist_data)
+    assert reused_rows(report) == (len(tree.codes) - 1) * len(previous.get(0))
+
+
+def test_unchanged_files_are_copied(tree):
+    _, previous, _ = ingest_reusing(tree)
+
+    # 只被 touch 的文件读取全部记录, sha1 相同, 仍然复制上次的日线
+    exchange, code = tree.codes[1]
+    fname = tree.day_file(exchange, code)
+    os.utime(fname, (2e9, 2e9))
+    hist_data, current, report = ingest_reusing(tree, previous=previous)
+
+    assert_same_as_clean(tree, hist_data)
+    assert reused_rows(report) == sum(len(bars) for _, bars in hist_data)
+    # 只有修改时间不同
+    entries = dict((sid, dict(entry)) for sid, entry in previous.fingerprints.entries.items())
+    entries['1']['mtime'] = 2e9
+    assert current.fingerprints.entries == entries
+
+
+def test_extended_session_range_reuses_previous_bars(tree):
+    end_session = pd.Timestamp('1996-03-29')
+    exchange, code = tree.codes[2]
+    write_day_file(tree.day_file(exchange, code), synthetic_day_records(300, seed=2))
+    _, previous, _ = ingest_reusing(tree)
+
+    for processes in (0, 2):
+        hist_data, _, report = ingest_reusing(tree, end_session, previous=previous, processes=processes)
+        assert_same_as_clean(tree, hist_data, end_session)
+        assert reused_rows(report) == len(tree.codes) * len(previous.get(0))
+
+
+def test_previous_bars_are_not_reused(tree):
+    _, previous, _ = ingest_reusing(tree)
+
+    # 开始日期不同, 上次的日线不是这次的前缀
+    config_start = START_SESSION + pd.Timedelta(days=7)
+    assert not previous.covers(SessionAligner(tree.calendar.sessions_in_range(config_start, END_SESSION)))
+    # 结束日期更早
+    assert not previous.covers(SessionAligner(tree.calendar.sessions_in_range(START_SESSION, '1995-10-31')))
+
+    # 大小不变, 被改写的文件
+    exchange, code = tree.codes[3]
+    write_day_file(tree.day_file(exchange, code), synthetic_day_records(250, seed=30))
+    hist_data, current, report = ingest_reusing(tree, previous=previous)
+
+    assert_same_as_clean(tree, hist_data)
+    assert reused_rows(report) == (len(tree.codes) - 1) * len(previous.get(0))
+    assert current.fingerprints.get(3, exchange + code)['sha1'] != previous.fingerprints.get(3, exchange + code)['sha1']
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from conftest import START_SESSION, END_SESSION
+from zipline_cn_databundle.ingest_report import IngestReport, ingest_report
+from zipline_cn_databundle.squant_config import SquantConfig
+from zipline_cn_databundle.squant_source import load_symbols, open_tdx_reader, filter_symbols, get_tdx_hist_data
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_daily_bars_parts_are_nested_stages(tree, tmpdir, processes):
+    config = SquantConfig(environ={}, tdx_dir=tree.vipdoc, processes=processes)
+    report = IngestReport()
+    tdx_reader, tdx_index = open_tdx_reader(config, report)
+    symbol_df, symbol_map = load_symbols(tree.symbol_list, START_SESSION, END_SESSION)
+    hist_symbol_map = filter_symbols(config, symbol_df, symbol_map, tdx_index, START_SESSION, END_SESSION)
+    hist_data = get_tdx_hist_data(config, symbol_df, hist_symbol_map, tdx_reader, START_SESSION, END_SESSION,
+                                  tree.calendar, report)
+    with report.stage('daily_bars'):
+        written = list(report.timed_iter('daily_source', hist_data))
+
+    stages = report.stages
+    assert stages['daily_source']['calls'] == len(written) == len(hist_symbol_map)
+    assert stages['tdx_decode']['calls'] == stages['align']['calls'] == len(written)
+    if not processes:
+        assert stages['tdx_decode']['wall'] + stages['align']['wall'] <= stages['daily_source']['wall']
+    assert stages['daily_source']['wall'] <= stages['daily_bars']['wall']
+
+    # 嵌套的环节不计入总耗时
+    result = report.to_dict()
+    assert sorted(result['nested']) == ['align', 'daily_source', 'tdx_decode']
+    assert result['wall'] == stages['tdx_index']['wall'] + stages['daily_bars']['wall']
+
+    path = str(tmpdir.join('report.json'))
+    report.save(path)
+    output = CliRunner().invoke(ingest_report, [path]).output
+    assert '  tdx_decode' in output
+    assert 'daily_bar_writer:' in output
+    with open(path) as f:
+        assert json.load(f)['nested'] == result['nested']
@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from conftest import START_SESSION, END_SESSION, RecordingWriters
+from fixtures import synthetic_day_records, write_day_file
+from zipline_cn_databundle.shard import ingest_shards
+from zipline_cn_databundle.spool import ShardMismatchException, ShardSpool
+from zipline_cn_databundle.squant_config import SquantConfig
+from zipline_cn_databundle.squant_source import ingest_squant
+
+
+def ingest(tree, **options):
+    """
+    用 ingest_squant 导入 tree, 返回记录了写入内容的 RecordingWriters
+    """
+    cqcx, cqcx_parser = tree.cqcx_files()
+    config = SquantConfig(environ={}, tdx_dir=tree.vipdoc, cqcx_sh=cqcx[0], cqcx_sz=cqcx[1], cqcx_cache='',
+                          **options)
+    writers = RecordingWriters()
+    ingest_squant(config, tree.symbol_list, cqcx_parser, *writers.args(), calendar=tree.calendar,
+                  start_session=START_SESSION, end_session=END_SESSION, show_progress=False)
+    return writers
+
+
+def test_sharded_ingest_matches_unsharded(tree, tmpdir):
+    # 提前停止交易和没有记录的代码, 起止日期来自通达信文件而不是代码列表
+    exchange, code = tree.codes[1]
+    write_day_file(tree.day_file(exchange, code), synthetic_day_records(80, seed=1))
+    exchange, code = tree.codes[4]
+    write_day_file(tree.day_file(exchange, code), synthetic_day_records(0))
+
+    shard_dir = str(tmpdir.mkdir('shards'))
+    config = SquantConfig(environ={}, tdx_dir=tree.vipdoc)
+    paths = ingest_shards(config, tree.symbol_list, tree.calendar, START_SESSION, END_SESSION, 3, shard_dir,
+                          processes=3)
+    assert [sorted(ShardSpool(path).sids('daily')) for path in paths] == [[0, 3], [1], [2, 5]]
+
+    sharded = ingest(tree, shard_dir=shard_dir)
+    unsharded = ingest(tree)
+
+    pd.testing.assert_frame_equal(sharded.asset_db_writer.data, unsharded.asset_db_writer.data)
+    assert sharded.asset_db_writer.data['end_date'].iloc[1] == pd.Timestamp('1995-04-24')
+    # 空文件的代码使用代码列表中的日期
+    assert tuple(sharded.asset_db_writer.data.loc[4, ['start_date', 'end_date']]) == (START_SESSION, END_SESSION)
+
+    assert [sid for sid, _ in sharded.daily_bar_writer.data] == [sid for sid, _ in unsharded.daily_bar_writer.data]
+    for (_, a), (_, b) in zip(sharded.daily_bar_writer.data, unsharded.daily_bar_writer.data):
+        pd.testing.assert_frame_equal(a, b)
+
+    for name in ('splits', 'dividends'):
+        pd.testing.assert_frame_equal(sharded.adjustment_writer.kwargs[name], unsharded.adjustment_writer.kwargs[name])
+
+
+def test_assets_outside_session_range_are_not_alive(tree):
+    # 在导入区间开始前停止交易, 以及在导入区间结束后才上市的代码
+    exchange, code = tree.codes[2]
+    write_day_file(tree.day_file(exchange, code), synthetic_day_records(15, seed=2))
+    exchange, code = tree.codes[5]
+    write_day_file(tree.day_file(exchange, code), synthetic_day_records(15, start='1996-01-02', seed=5))
+
+    writers = ingest(tree)
+
+    assets = writers.asset_db_writer.data
+    assert tuple(assets.loc[2, ['start_date', 'end_date']]) == (START_SESSION, pd.Timestamp('1995-01-23'))
+    assert tuple(assets.loc[5, ['start_date', 'end_date']]) == (pd.Timestamp('1996-01-02'), END_SESSION)
+    # 没有日线的代码在导入区间内的任何一天都不存在
+    hist_sids = [sid for sid, _ in writers.daily_bar_writer.data]
+    assert hist_sids == [0, 1, 3, 4]
+    alive = assets[(assets['start_date'] <= END_SESSION) & (assets['end_date'] >= START_SESSION) &
+                   (assets['start_date'] <= assets['end_date'])]
+    assert list(alive.index) == hist_sids
+
+
+def test_merge_rejects_mismatched_shards(tree, tmpdir):
+    shard_dir = str(tmpdir.mkdir('shards'))
+    config = SquantConfig(environ={}, tdx_dir=tree.vipdoc)
+    ingest_shards(config, tree.symbol_list, tree.calendar, START_SESSION, END_SESSION, 2, shard_dir, processes=2)
+
+    # 分片时没有使用 compact 模式
+    with pytest.raises(ShardMismatchException):
+        ingest(tree, shard_dir=shard_dir, compact=1)
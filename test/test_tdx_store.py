@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import pytest
+
+from fixtures import synthetic_day_records, write_day_file
+from zipline_cn_databundle.tdx.columnar import TdxColumnarStore, build_columnar_store
+from zipline_cn_databundle.tdx.incremental import TdxManifest, UNCHANGED, APPENDED, CHANGED
+from zipline_cn_databundle.tdx.reader import TDX_DAY_DTYPE, TdxReader
+
+
+@pytest.fixture
+def day_file(tmpdir):
+    fname = str(tmpdir.join('sh600000.day'))
+    records = synthetic_day_records(100)
+    write_day_file(fname, records)
+    os.utime(fname, (1e9, 1e9))
+    return fname, records
+
+
+def rewrite(fname, records, mtime):
+    write_day_file(fname, records)
+    os.utime(fname, (mtime, mtime))
+
+
+def recorded_manifest(tmpdir, fname, records):
+    """
+    :return: 读取了 records 之后保存, 再重新加载的 TdxManifest
+    """
+    path = str(tmpdir.join('index.json'))
+    manifest = TdxManifest(path)
+    manifest.entries['sh600000'] = manifest.make_entry(fname, records)
+    manifest.save()
+    return TdxManifest(path)
+
+
+def test_unknown_file_is_changed(tmpdir, day_file):
+    fname, records = day_file
+    manifest = TdxManifest(str(tmpdir.join('index.json')))
+    assert manifest.check('sh600000', fname) == (CHANGED, 0)
+    assert not manifest.is_current('sh600000', os.path.getsize(fname), 1e9)
+
+
+def test_unchanged_file(tmpdir, day_file):
+    fname, records = day_file
+    manifest = recorded_manifest(tmpdir, fname, records)
+    assert manifest.check('sh600000', fname) == (UNCHANGED, 100 * TDX_DAY_DTYPE.itemsize)
+    assert manifest.is_current('sh600000', os.path.getsize(fname), 1e9)
+    # 同一个代码换了文件路径时重新读取
+    assert manifest.check('sh600000', fname + '.copy') == (CHANGED, 0)
+
+
+def test_appended_file(tmpdir, day_file):
+    fname, records = day_file
+    manifest = recorded_manifest(tmpdir, fname, records)
+    appended = synthetic_day_records(110)
+    appended[:100] = records
+    rewrite(fname, appended, 2e9)
+
+    assert manifest.check('sh600000', fname) == (APPENDED, 100 * TDX_DAY_DTYPE.itemsize)
+    assert not manifest.is_current('sh600000', os.path.getsize(fname), 2e9)
+
+
+def test_partially_read_file_is_appended(tmpdir, day_file):
+    # 上次只读取了前面的记录 (读取之后文件又有追加), 大小和修改时间不变也不是最新的
+    fname, records = day_file
+    manifest = recorded_manifest(tmpdir, fname, records[:90])
+    assert manifest.check('sh600000', fname) == (APPENDED, 90 * TDX_DAY_DTYPE.itemsize)
+    assert not manifest.is_current('sh600000', os.path.getsize(fname), 1e9)
+
+
+@pytest.mark.parametrize('change', ['truncated', 'last_record', 'same_size'])
+def test_rewritten_file_is_changed(tmpdir, day_file, change):
+    fname, records = day_file
+    manifest = recorded_manifest(tmpdir, fname, records)
+    if change == 'truncated':
+        changed = records[:50]
+    elif change == 'last_record':
+        # 最后一条记录被删除后再追加, 不能只读取追加的部分
+        changed = np.concatenate([records[:99], synthetic_day_records(111)[100:]])
+    else:
+        # 大小不变, 只有修改时间不同
+        changed = synthetic_day_records(100, seed=1)
+    rewrite(fname, changed, 2e9)
+
+    assert manifest.check('sh600000', fname) == (CHANGED, 0)
+    assert not manifest.is_current('sh600000', os.path.getsize(fname), 2e9)
+
+
+def test_reader_skips_stale_store_entries(tmpdir):
+    vipdoc = str(tmpdir.join('vipdoc'))
+    store = str(tmpdir.join('store'))
+    files = {}
+    for i, (exchange, code) in enumerate([('sh', '600000'), ('sh', '600001'), ('sz', '000001')]):
+        files[(exchange, code)] = write_day_file(os.path.join(vipdoc, exchange, 'lday', '%s%s.day' % (exchange, code)),
+                                                 synthetic_day_records(100, seed=i))
+    assert build_columnar_store(vipdoc, store) == {'unchanged': 0, 'appended': 0, 'changed': 3}
+
+    # 600000 有追加, 600001 大小不变但被改写
+    appended = np.concatenate([synthetic_day_records(100), synthetic_day_records(110)[100:]])
+    rewrite(files[('sh', '600000')], appended, 2e9)
+    rewritten = synthetic_day_records(100, seed=9)
+    rewrite(files[('sh', '600001')], rewritten, 2e9)
+
+    for build_index in (False, True):
+        reader = TdxReader(vipdoc, store_path=store)
+        if build_index:
+            reader.build_index()
+        np.testing.assert_array_equal(reader.get_records('600000', 'sh'), appended)
+        np.testing.assert_array_equal(reader.get_records('600001', 'sh'), rewritten)
+        np.testing.assert_array_equal(reader.get_records('000001', 'sz'), synthetic_day_records(100, seed=2))
+
+    assert build_columnar_store(vipdoc, store) == {'unchanged': 1, 'appended': 1, 'changed': 1}
+    updated = TdxColumnarStore(store)
+    np.testing.assert_array_equal(updated.get_records('sh600000'), appended)
+    np.testing.assert_array_equal(updated.get_records('sh600001'), rewritten)
@@ -0,0 +1,29 @@
+import pandas as pd
+
+from conftest import RecordingWriters, WeekdayCalendar
+from zipline_cn_databundle import tushare_source
+
+
+def test_symbols_without_history_are_not_written(server, monkeypatch):
+    # 000002 在服务器上没有行情 (404), 000005 重试后仍然失败
+    server.failures = {'000005': 10}
+    basics = pd.DataFrame({
+        'name': ['A', 'B', 'C', 'D'],
+        'timeToMarket': [20100101, 20100101, 0, 20100101],
+    }, index=pd.Index(['600000', '000002', '000001', '000005'], name='code'))
+    monkeypatch.setattr(tushare_source, 'get_stock_basics', lambda: basics)
+    empty_splits = pd.DataFrame(columns=['effective_date', 'ratio', 'sid'])
+    empty_dividends = pd.DataFrame(columns=['amount', 'ex_date', 'sid'])
+    monkeypatch.setattr(tushare_source, 'zipline_splits_and_dividends',
+                        lambda symbol_map: (empty_splits, empty_dividends))
+    server.histories = dict((code, server.histories['%06d' % i]) for i, code in enumerate(['600000', '000001']))
+
+    writers = RecordingWriters()
+    environ = {'TUSHARE_URL': server.url, 'TUSHARE_CACHE': '', 'TUSHARE_RATE': '0', 'TUSHARE_RETRIES': '0'}
+    tushare_source.tushare_bundle(environ, *writers.args(), calendar=WeekdayCalendar(),
+                                  start_session=pd.Timestamp('2017-01-02'), end_session=pd.Timestamp('2017-02-10'),
+                                  cache=None, show_progress=False, output_dir=None)
+
+    metadata = writers.asset_db_writer.data
+    assert list(metadata['symbol']) == ['000001.SZ', '600000.SS']
+    assert [sid for sid, _ in writers.daily_bar_writer.data] == list(metadata.index)
@@ -0,0 +1,58 @@
+import threading
+
+from zipline_cn_databundle.yahoo_probe import YahooProber
+
+
+class Response(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class ScriptedSession(object):
+    """
+    每个代码依次返回 script[code] 中的状态码, 异常直接抛出, 用完后重复最后一个
+    """
+
+    def __init__(self, script):
+        self.script = dict((code, list(steps)) for code, steps in script.items())
+        self.calls = dict.fromkeys(script, 0)
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None):
+        code = url
+        with self.lock:
+            steps = self.script[code]
+            step = steps.pop(0) if len(steps) > 1 else steps[0]
+            self.calls[code] += 1
+        if isinstance(step, Exception):
+            raise step
+        return Response(step)
+
+
+def test_probe_retries_errors_other_than_404():
+    session = ScriptedSession({
+        'ok': [200],
+        'missing': [404],
+        'throttled': [429, 503, 200],
+        'timeout': [IOError('timed out'), 200],
+        'down': [500],
+    })
+    sleeps = []
+    prober = YahooProber(url_template='%s', workers=2, rate=0, retries=2, backoff=0.5, progress_every=0,
+                         session=session, sleep=sleeps.append)
+
+    assert list(prober.probe(['ok', 'missing', 'throttled', 'timeout', 'down'])) == [
+        ('ok', True), ('missing', False), ('throttled', True), ('timeout', True), ('down', False)]
+    assert session.calls == {'ok': 1, 'missing': 1, 'throttled': 3, 'timeout': 2, 'down': 3}
+    assert sorted(sleeps) == [0.5, 0.5, 0.5, 1.0, 1.0]
+    # 只有重试后仍然失败的代码记录在 errors 中
+    assert prober.errors == {'down': 500}
+
+
+def test_from_environ():
+    prober = YahooProber.from_environ({'YAHOO_PROBE_RATE': '2', 'YAHOO_PROBE_RETRIES': '5'}, workers=4)
+    assert (prober.bucket.rate, prober.retries, prober.workers) == (2.0, 5, 4)
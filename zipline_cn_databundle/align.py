@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+from .tdx.reader import TDX_PRICE_FIELDS, dates_to_int
+
+"""
+把日线对齐到交易日
+
+交易日索引和日期到位置的映射只计算一次, 每个代码的记录直接放到预先分配好的数组中,
+代替逐个代码的 reindex + fillna
+"""
+
+BAR_FIELDS = TDX_PRICE_FIELDS + ('volume',)
+
+# 紧凑模式的日线, 与 BcolzDailyBarWriter 写入的格式相同:
+# day 为秒, 价格为元 * 1000, 成交量为股数, 都是 uint32
+COMPACT_BAR_DTYPE = np.dtype([(field, np.uint32) for field in ('day',) + BAR_FIELDS])
+UINT32_MAX = np.iinfo(np.uint32).max
+
+
+class SessionAligner(object):
+
+    def __init__(self, sessions):
+        """
+        :param sessions: 交易日, 如 calendar.sessions_in_range(start_session, end_session)
+        """
+        sessions = pd.DatetimeIndex(sessions)
+        if sessions.tz is not None:
+            sessions = sessions.tz_localize(None)
+        self.sessions = sessions
+        self.session_dates = dates_to_int(sessions)
+        self.session_seconds = sessions.values.astype('datetime64[s]').astype(np.int64).astype(np.uint32)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @property
+    def first_date(self):
+        return self.session_dates[0] if len(self.session_dates) else 0
+
+    @property
+    def last_date(self):
+        return self.session_dates[-1] if len(self.session_dates) else 0
+
+    def positions(self, dates):
+        """
+        :param dates: YYYYMMDD 整数数组
+        :return: (positions, valid), dates[valid] 在交易日中的位置为 positions
+        """
+        positions = np.searchsorted(self.session_dates, dates)
+        valid = positions < len(self.session_dates)
+        valid[valid] = self.session_dates[positions[valid]] == dates[valid]
+        return positions[valid], valid
+
+    def align_records(self, records):
+        """
+        把通达信日线记录放到交易日上, 没有记录的交易日为 0
+
+        :param records: TDX_DAY_DTYPE 结构化数组
+        :return: 索引为交易日, 列为 open, high, low, close, volume 的 float64 DataFrame,
+                 与 get_df 之后 reindex(sessions).fillna(0.0) 的结果相同
+        """
+        positions, valid = self.positions(records['date'])
+        buffer = np.zeros((len(self.session_dates), len(BAR_FIELDS)))
+        for i, field in enumerate(BAR_FIELDS):
+            values = records[field][valid]
+            if field in TDX_PRICE_FIELDS:
+                values = values * 0.01
+            buffer[positions, i] = values
+        return pd.DataFrame(buffer, index=self.sessions, columns=BAR_FIELDS)
+
+    def align_frame(self, history):
+        """
+        把以日期为索引的行情 (如 tushare.get_hist_data 的结果, 索引可以是 YYYY-MM-DD 字符串) 放到交易日上,
+        不在交易日中的行丢弃, 没有行情的交易日为 0
+
+        :return: 与 align_records 格式相同的 DataFrame
+        """
+        positions, valid = self.positions(dates_to_int(pd.to_datetime(history.index)))
+        buffer = np.zeros((len(self.session_dates), len(BAR_FIELDS)))
+        for i, field in enumerate(BAR_FIELDS):
+            buffer[positions, i] = history[field].values[valid]
+        return pd.DataFrame(buffer, index=self.sessions, columns=BAR_FIELDS)
+
+    def align_compact(self, records):
+        """
+        与 align_records 相同, 但不经过 float64 和 DataFrame, 直接生成 writer 需要的 uint32 数据
+
+        通达信价格单位为分, * 10 即为元 * 1000, 不存在浮点误差; 超出 uint32 范围的值
+        与 writer 的 winsorise_uint32 一样置为 0
+
+        :param records: TDX_DAY_DTYPE 结构化数组
+        :return: COMPACT_BAR_DTYPE 结构化数组, 长度为交易日个数, 没有记录的交易日为 0
+        """
+        bars = np.zeros(len(self.session_dates), dtype=COMPACT_BAR_DTYPE)
+        bars['day'] = self.session_seconds
+        return self.fill_compact(bars, records)
+
+    def fill_compact(self, bars, records):
+        """
+        把 records 写入 bars 中对应交易日的位置, 其他位置不变, 用于在上次导入的日线中补上新追加的记录
+
+        :param bars: align_compact 格式的结构化数组, 原地修改
+        :return: bars
+        """
+        positions, valid = self.positions(records['date'])
+        for field in BAR_FIELDS:
+            values = records[field][valid].astype(np.int64)
+            if field in TDX_PRICE_FIELDS:
+                values *= 10
+            values[(values < 0) | (values > UINT32_MAX)] = 0
+            bars[field][positions] = values
+        return bars
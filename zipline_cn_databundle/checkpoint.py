@@ -0,0 +1,120 @@
+"""
+导入中断后继续
+
+zipline 每次 ingest 都写入新的时间戳目录, 但传给 bundle 的 cache (dataframe_cache) 在导入
+失败时保留, 成功后才清空. 每个代码对齐后的日线写入 cache, 再次导入时已经写入的代码直接从
+cache 读取, 不再解析通达信文件, 交给 writer 的数据和顺序与完整导入相同
+
+导入参数 (通达信目录, 日期区间, compact 模式) 变化后, 之前的检查点全部丢弃; 每个代码同时保存
+解析前通达信文件的大小和修改时间, 再次导入前文件有变化 (比如两次导入之间更新了通达信数据) 的代码
+从检查点中删除, 重新解析
+"""
+import numpy as np
+import pandas as pd
+
+from .align import COMPACT_BAR_DTYPE
+
+CHECKPOINT_PARAMS_KEY = 'squant_checkpoint'
+CHECKPOINT_DAILY_PREFIX = 'squant_daily_'
+CHECKPOINT_SOURCE_PREFIX = 'squant_source_'
+
+
+class IngestCheckpoint(object):
+
+    def __init__(self, cache, **params):
+        """
+        :param cache: zipline 传给 ingest 的 cache, 或者其他以字符串为键保存 DataFrame 的 MutableMapping
+        :param params: 决定日线内容的导入参数, 与上次不同时清空检查点
+        """
+        self.cache = cache
+        params = pd.DataFrame({'value': [str(params[name]) for name in sorted(params)]},
+                              index=sorted(params))
+        if CHECKPOINT_PARAMS_KEY not in cache or not cache[CHECKPOINT_PARAMS_KEY].equals(params):
+            self.clear()
+            cache[CHECKPOINT_PARAMS_KEY] = params
+
+    def _key(self, sid):
+        return '%s%d' % (CHECKPOINT_DAILY_PREFIX, sid)
+
+    def _source_key(self, sid):
+        return '%s%d' % (CHECKPOINT_SOURCE_PREFIX, sid)
+
+    def clear(self):
+        for key in list(self.cache):
+            if key == CHECKPOINT_PARAMS_KEY or key.startswith(CHECKPOINT_DAILY_PREFIX) \
+                    or key.startswith(CHECKPOINT_SOURCE_PREFIX):
+                del self.cache[key]
+
+    def discard(self, sid):
+        for key in (self._key(sid), self._source_key(sid)):
+            if key in self.cache:
+                del self.cache[key]
+
+    def source(self, sid):
+        """
+        :return: 保存检查点时源文件的 (size, mtime), 没有记录时为 None
+        """
+        key = self._source_key(sid)
+        if key not in self.cache:
+            return None
+        source = self.cache[key]
+        return int(source['size'].iloc[0]), float(source['mtime'].iloc[0])
+
+    def completed(self, sources=None):
+        """
+        :param sources: {sid: (size, mtime)} 源文件当前的状态, 与保存检查点时不同或没有记录的 sid 从检查点中删除
+        :return: 已经保存日线的 sid 集合
+        """
+        done = set(int(key[len(CHECKPOINT_DAILY_PREFIX):]) for key in self.cache
+                   if key.startswith(CHECKPOINT_DAILY_PREFIX))
+        if sources is None:
+            return done
+
+        changed = set(sid for sid in done if self.source(sid) != sources.get(sid))
+        for sid in changed:
+            self.discard(sid)
+        return done - changed
+
+    def save(self, sid, history, source=None):
+        """
+        :param history: 对齐后的日线 DataFrame, 或 compact 模式的结构化数组
+        :param source: 解析前源文件的 (size, mtime)
+        """
+        if isinstance(history, np.ndarray):
+            history = pd.DataFrame(history)
+        self.cache[self._key(sid)] = history
+        if source is not None:
+            size, mtime = source
+            self.cache[self._source_key(sid)] = pd.DataFrame({'size': [size], 'mtime': [mtime]})
+
+    def load(self, sid, compact=False):
+        history = self.cache[self._key(sid)]
+        if compact:
+            bars = np.zeros(len(history), dtype=COMPACT_BAR_DTYPE)
+            for field in COMPACT_BAR_DTYPE.names:
+                bars[field] = history[field].values
+            return bars
+        return history
+
+    def resume(self, order, hist_data, compact=False, sources=None):
+        """
+        把检查点中的日线和新解析的日线按 order 的顺序合并, 新解析的日线同时写入检查点
+
+        :param order: 完整导入时 hist_data 的 sid 顺序
+        :param hist_data: 只包括不在检查点中的代码, 按 order 的顺序产生 (sid, history)
+        :param sources: {sid: (size, mtime)} 解析前源文件的状态, 与日线一起保存
+        """
+        sources = sources or {}
+        position = dict((sid, i) for i, sid in enumerate(order))
+        done = sorted(self.completed() & set(position), key=position.get)
+
+        i = 0
+        for sid, history in hist_data:
+            while i < len(done) and position[done[i]] < position[sid]:
+                yield done[i], self.load(done[i], compact)
+                i += 1
+            self.save(sid, history, sources.get(sid))
+            yield sid, history
+
+        for sid in done[i:]:
+            yield sid, self.load(sid, compact)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+"""
+缓存解析后的除权除息数据
+
+CQCX_SH, CQCX_SZ 很少变化, 解析结果以列式的 npz 保存, 以文件的大小, 修改时间和内容的 sha1 作为键,
+大小和修改时间都没有变化时直接使用缓存, 否则比较 sha1, 内容有变化才重新解析
+"""
+
+# 除权除息记录中用到的字段
+CQCX_COLUMNS = ['stock', 'date', 'sgVal', 'pxVal']
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def cqcx_to_frame(data):
+    """
+    把 file_parser.get_cqcx 的结果转换为只有 CQCX_COLUMNS 的 DataFrame
+    """
+    if isinstance(data, pd.DataFrame):
+        return data[CQCX_COLUMNS]
+    if len(data) == 0:
+        return pd.DataFrame(columns=CQCX_COLUMNS)
+    return pd.DataFrame.from_records(data, columns=CQCX_COLUMNS)
+
+
+class CqcxCache(object):
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _paths(self, path):
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, name)
+        return base + '.json', base + '.npz'
+
+    def load(self, path, parser):
+        """
+        :param path: 除权除息文件路径
+        :param parser: 缓存失效时调用 parser(path) 解析文件, 如 file_parser.get_cqcx
+        :return: DataFrame, 列为 CQCX_COLUMNS
+        """
+        meta_path, data_path = self._paths(path)
+        st = os.stat(path)
+        meta = None
+        if os.path.isfile(meta_path) and os.path.isfile(data_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+
+        sha1 = None
+        if meta is not None:
+            if meta['size'] == st.st_size and meta['mtime'] == st.st_mtime:
+                return self._read(data_path)
+            sha1 = file_sha1(path)
+            if meta['sha1'] == sha1:
+                self._write_meta(meta_path, st, sha1)
+                return self._read(data_path)
+
+        df = cqcx_to_frame(parser(path))
+        np.savez(data_path, **{column: df[column].values for column in CQCX_COLUMNS})
+        self._write_meta(meta_path, st, sha1 or file_sha1(path))
+        return df
+
+    def _read(self, data_path):
+        with np.load(data_path) as data:
+            return pd.DataFrame({column: data[column] for column in CQCX_COLUMNS}, columns=CQCX_COLUMNS)
+
+    def _write_meta(self, meta_path, st, sha1):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': st.st_size, 'mtime': st.st_mtime, 'sha1': sha1}, f)
+        os.replace(tmp_path, meta_path)
@@ -0,0 +1,265 @@
+"""
+并发获取每个代码的历史行情, 用于 tushare_bundle
+
+    * 线程池并发请求, 结果按代码顺序返回, 同时在请求中或等待取走的代码数有上限
+    * 令牌桶限制每秒请求数, 避免触发数据源的频率限制
+    * 每次请求在 timeout 秒内没有返回视为失败, 与 transport 自己的超时无关
+    * 失败后按指数退避重试, 重试后仍然失败的代码跳过并记录在 failures 中
+    * 请求通过 transport 发出, 默认为 tushare, 也可以换成 HttpCsvTransport 指向本地的模拟服务器
+    * 设置 cache 后行情保存在本地, 之后只从缓存的最后日期开始请求, 见 history_cache
+
+配置可以通过环境变量设置, 见 FETCHER_ENVIRON
+"""
+import io
+import os
+import threading
+import time
+
+import pandas as pd
+
+from .history_cache import HistoryCache, records_to_history
+from .parallel import ordered_thread_imap
+
+# 参数名 => (环境变量, 默认值)
+FETCHER_ENVIRON = {
+    'workers': ('TUSHARE_WORKERS', 8),
+    # 每秒最多请求数, 0 表示不限制
+    'rate': ('TUSHARE_RATE', 5),
+    'retries': ('TUSHARE_RETRIES', 3),
+    # 单次请求超时秒数
+    'timeout': ('TUSHARE_TIMEOUT', 30),
+    # 最多同时在请求中或已下载但还没被 writer 取走的代码数, 0 表示线程数的 2 倍
+    'prefetch': ('TUSHARE_PREFETCH', 0),
+    # 设置后从 url (如 http://127.0.0.1:8000/hist/%s.csv) 获取 csv, 代替 tushare
+    'url': ('TUSHARE_URL', None),
+    # 本地缓存目录, 默认为 ~/.zipline_cn_databundle/tushare, 设置为空字符串时不使用缓存
+    'cache': ('TUSHARE_CACHE', None),
+    # 缓存在多少小时内不需要更新
+    'cache_max_age': ('TUSHARE_CACHE_MAX_AGE', 12),
+    # 每隔多少天重新下载全部行情, 0 表示只追加
+    'full_refresh_days': ('TUSHARE_FULL_REFRESH_DAYS', 0),
+    # 设置为 1 时只使用缓存, 不请求数据源
+    'offline': ('TUSHARE_OFFLINE', 0),
+}
+
+
+class TokenBucket(object):
+    """
+    线程安全的令牌桶, 平均每秒 rate 个令牌, 最多积累 burst 个
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        取一个令牌, 没有令牌时等待; 等待时间在锁内预定, 所以多个线程按先后顺序得到令牌
+        """
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.sleep(wait)
+
+
+class FetchTimeout(Exception):
+    pass
+
+
+def call_with_deadline(func, timeout, *args, **kwargs):
+    """
+    在单独的线程中调用 func, 超过 timeout 秒没有返回时抛出 FetchTimeout
+    超时的调用不能被中断, 在后台线程中继续执行, 结果被丢弃
+    :param timeout: 秒数, 0 或 None 表示不限制, 在当前线程中直接调用
+    """
+    if not timeout:
+        return func(*args, **kwargs)
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func(*args, **kwargs)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise FetchTimeout('no response in %s seconds' % timeout)
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+class TushareTransport(object):
+    """
+    通过 tushare.get_hist_data 获取日线, 重试由 HistoryFetcher 控制
+
+    tushare 内部每次读取的超时固定为 10 秒, 不使用 timeout 参数, 整个请求的超时由 HistoryFetcher 限制
+    """
+
+    def __init__(self, ktype='D'):
+        self.ktype = ktype
+
+    def __call__(self, symbol, timeout, start=None):
+        """
+        :param start: YYYY-MM-DD, 只获取这一天及之后的行情
+        """
+        import tushare as ts
+        return ts.get_hist_data(symbol, start=start or '', ktype=self.ktype, retry_count=1)
+
+
+def pooled_session(pool_size):
+    """
+    :return: requests.Session, http 和 https 每个主机最多保持 pool_size 个连接, 供多个线程共用
+    """
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HttpCsvTransport(object):
+    """
+    从 url_template % symbol 下载与 tushare.get_hist_data 格式相同的 csv, 第一列为日期
+    多个线程共用一个 requests.Session 的连接池, 404 表示没有这个代码的数据
+    增量获取时把开始日期作为 start 参数传给服务器
+    """
+
+    def __init__(self, url_template, pool_size=8, session=None):
+        self.url_template = url_template
+        self.pool_size = pool_size
+        self._session = session
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = pooled_session(self.pool_size)
+        return self._session
+
+    def __call__(self, symbol, timeout, start=None):
+        params = {'start': start} if start else None
+        response = self.session.get(self.url_template % symbol, params=params, timeout=timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return pd.read_csv(io.StringIO(response.text), index_col=0, parse_dates=True)
+
+
+class HistoryFetcher(object):
+
+    def __init__(self, transport=None, workers=8, rate=5, burst=None, retries=3, backoff=1.0, timeout=30,
+                 prefetch=None, cache=None, sleep=time.sleep):
+        """
+        :param transport: transport(symbol, timeout, start=None) 返回 DataFrame, 没有数据时返回 None,
+                          默认为 TushareTransport
+        :param workers: 并发请求的线程数
+        :param rate: 每秒最多请求数, 包括重试, 0 表示不限制
+        :param burst: 令牌桶容量, 默认为 rate
+        :param retries: 失败后的重试次数
+        :param backoff: 第 n 次重试前等待 backoff * 2 ** (n - 1) 秒
+        :param timeout: 单次请求超时秒数, 传给 transport, 并且超过这个时间没有返回的请求视为失败
+        :param prefetch: fetch 默认的 max_inflight
+        :param cache: HistoryCache, 为 None 时每次都完整下载
+        """
+        self.transport = transport or TushareTransport()
+        self.workers = max(int(workers), 1)
+        self.bucket = TokenBucket(rate, burst, sleep=sleep)
+        self.retries = int(retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.prefetch = prefetch or None
+        self.cache = cache
+        self.sleep = sleep
+        # 重试后仍然失败的 {代码: 异常}
+        self.failures = {}
+
+    @classmethod
+    def from_environ(cls, environ=None, transport=None, **options):
+        """
+        根据 FETCHER_ENVIRON 中的环境变量创建, options 中的参数优先
+        """
+        environ = os.environ if environ is None else environ
+        values = dict((name, environ.get(env_name, default)) for name, (env_name, default) in FETCHER_ENVIRON.items())
+        values.update(options)
+
+        url = values.pop('url')
+        if transport is None and url:
+            transport = HttpCsvTransport(url, pool_size=int(values['workers']))
+
+        cache_dir = values['cache']
+        if cache_dir is None:
+            from .all_stocks import get_cache_dir
+            cache_dir = os.path.join(get_cache_dir(), 'tushare')
+        cache = None
+        if cache_dir:
+            cache = HistoryCache(cache_dir,
+                                 max_age=float(values['cache_max_age']) * 3600,
+                                 full_refresh=float(values['full_refresh_days']) * 86400,
+                                 offline=bool(int(values['offline'])))
+        return cls(transport=transport,
+                   workers=int(values['workers']),
+                   rate=float(values['rate']),
+                   retries=int(values['retries']),
+                   timeout=float(values['timeout']),
+                   prefetch=int(values['prefetch']),
+                   cache=cache)
+
+    def request(self, symbol, start=None):
+        """
+        请求一次数据源, 失败后重试
+        :return: (DataFrame or None, 是否成功)
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+            self.bucket.acquire()
+            try:
+                if start:
+                    return call_with_deadline(self.transport, self.timeout, symbol, self.timeout, start=start), True
+                return call_with_deadline(self.transport, self.timeout, symbol, self.timeout), True
+            except Exception as e:
+                error = e
+        self.failures[symbol] = error
+        return None, False
+
+    def fetch_one(self, symbol):
+        """
+        :return: (symbol, DataFrame), 没有数据或重试后仍然失败时为 (symbol, None)
+        """
+        if self.cache is None:
+            return symbol, self.request(symbol)[0]
+
+        records, start = self.cache.lookup(symbol)
+        if start is not None:
+            history, ok = self.request(symbol, start)
+            # 失败时使用之前的缓存, 代码仍然记录在 failures 中
+            if ok:
+                records = self.cache.update(symbol, records, start, history)
+        if records is None or len(records) == 0:
+            return symbol, None
+        return symbol, records_to_history(records)
+
+    def fetch(self, symbols, max_inflight=None):
+        """
+        并发获取, 按 symbols 的顺序产生 (symbol, DataFrame or None)
+        只有在上一个结果被取走后才会提交新的请求, 所以内存中最多只有 max_inflight 个代码的行情
+        :param max_inflight: 最多同时在请求中或等待取走的代码数, 默认为 prefetch 或线程数的 2 倍
+        """
+        return ordered_thread_imap(self.fetch_one, ((symbol,) for symbol in symbols),
+                                   threads=self.workers, max_inflight=max_inflight or self.prefetch)
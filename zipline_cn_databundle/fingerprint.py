@@ -0,0 +1,211 @@
+"""
+跳过没有变化的代码
+
+每次导入后在 bundle 目录中保存每个 sid 的日线指纹: 导入区间内记录的条数, 最后日期,
+这些记录原始字节的 sha1, 以及通达信文件的大小和修改时间. 下次导入时找到同一个 bundle
+上一次的导入目录:
+
+    * 文件大小和修改时间不变, 日期区间相同, 直接复制上次写入的日线, 不读取通达信文件
+    * 文件有追加 (与 TdxManifest.check 相同, 上次读取的最后一条记录没有变化), 复制上次的日线,
+      只从上次的位置开始读取新的记录, 写入对应的交易日; 导入区间不变 (比如注册 bundle 时固定了
+      end_session) 或者向后延长都可以复用
+    * 否则读取整个文件, 上次的记录仍是这次记录的前缀 (sha1 相同, 比如文件被重新下载) 时同样只写入新的记录
+    * 其他情况 (数据被修正, 文件被重写) 指纹不同, 重新对齐全部记录
+
+只读取了追加部分时没有全部记录的字节, 指纹中的 sha1 为 None, 下次不能用 sha1 判断前缀;
+与 TdxManifest 一样, 文件有追加并且上次的最后一条记录没有变化时, 不会发现之前的记录被修正
+
+上次的日线从 daily_equities.bcolz 中按 sid 读取, 格式与 compact 模式相同, 所以这个模式
+总是使用 compact 模式
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .align import COMPACT_BAR_DTYPE
+from .tdx.reader import TDX_DAY_DTYPE, dates_to_int
+
+FINGERPRINT_FILE = 'squant_fingerprints.json'
+DAILY_BCOLZ = 'daily_equities.bcolz'
+
+
+def records_fingerprint(records):
+    """
+    :param records: TDX_DAY_DTYPE 结构化数组
+    :return: 原始字节的 sha1
+    """
+    return hashlib.sha1(np.ascontiguousarray(records).tobytes()).hexdigest()
+
+
+def fingerprint_entry(key, records, stat):
+    """
+    :param records: 导入区间结束前的所有记录
+    :param stat: 读取记录前通达信文件的 (size, mtime)
+    """
+    size, mtime = stat
+    return {
+        'key': key,
+        'rows': len(records),
+        'last_date': int(records['date'][-1]) if len(records) else 0,
+        'sha1': records_fingerprint(records),
+        'size': size,
+        'mtime': mtime,
+    }
+
+
+def appended_entry(entry, appended, stat):
+    """
+    :param entry: 上次导入的指纹
+    :param appended: read_appended_records 读取的导入区间结束前的记录
+    :param stat: 读取记录前通达信文件的 (size, mtime)
+    """
+    size, mtime = stat
+    return {
+        'key': entry['key'],
+        'rows': entry['rows'] + len(appended),
+        'last_date': int(appended['date'][-1]) if len(appended) else entry['last_date'],
+        'sha1': None,
+        'size': size,
+        'mtime': mtime,
+    }
+
+
+def read_appended_records(fname, entry, stat):
+    """
+    文件在上次导入的记录之后只有追加时, 从上次的位置开始读取
+    :param stat: 读取前文件的 (size, mtime)
+    :return: 上次导入之后的记录, 不能确定只有追加 (文件被截断或重写) 时返回 None
+    """
+    size, mtime = stat
+    offset = entry['rows'] * TDX_DAY_DTYPE.itemsize
+    # 文件没有变化时, 上次只读取了导入区间内的记录, 之后的记录可能在这次的区间内;
+    # 文件有变化时, 只有比上次大才可能是追加, 大小不变说明文件被改写
+    if (size, mtime) != (entry['size'], entry['mtime']) and size <= entry['size']:
+        return None
+    with open(fname, 'rb') as f:
+        f.seek(offset - TDX_DAY_DTYPE.itemsize)
+        last = np.fromfile(f, dtype=TDX_DAY_DTYPE, count=1)
+        if len(last) != 1 or last['date'][0] != entry['last_date']:
+            return None
+        return np.fromfile(f, dtype=TDX_DAY_DTYPE)
+
+
+class DailyFingerprints(object):
+
+    def __init__(self, start_date, end_date, entries=None):
+        """
+        :param start_date: 导入区间, YYYYMMDD 整数
+        :param entries: {'sid': {'key':, 'rows':, 'last_date':, 'sha1':, 'size':, 'mtime':}}
+        """
+        self.start_date = int(start_date)
+        self.end_date = int(end_date)
+        self.entries = entries or {}
+
+    @classmethod
+    def for_sessions(cls, sessions):
+        """
+        :param sessions: 导入的交易日, 区间为第一个和最后一个交易日
+        """
+        dates = dates_to_int(sessions)
+        return cls(dates[0], dates[-1])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['start_date'], data['end_date'], data['entries'])
+
+    def save(self, output_dir):
+        path = os.path.join(output_dir, FINGERPRINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                'start_date': self.start_date,
+                'end_date': self.end_date,
+                'entries': self.entries,
+            }, f)
+        os.rename(path + '.tmp', path)
+
+    def get(self, sid, key):
+        entry = self.entries.get(str(sid))
+        if entry is None or entry['key'] != key:
+            return None
+        return entry
+
+    def set_entry(self, sid, entry):
+        """
+        :param entry: fingerprint_entry 的结果, 或上次导入的指纹
+        """
+        self.entries[str(sid)] = entry
+
+    def is_prefix(self, entry, records):
+        """
+        :return: records 的前 entry['rows'] 条与上次导入的记录相同
+        """
+        rows = entry['rows']
+        if entry['sha1'] is None or rows > len(records):
+            return False
+        return records_fingerprint(records[:rows]) == entry['sha1']
+
+
+def find_previous_ingestion(output_dir):
+    """
+    zipline 的 output_dir 为 data/<bundle>/<时间戳>, 同一目录下时间戳更早, 并且保存了指纹
+    和日线的目录即为上次导入
+    """
+    parent, name = os.path.split(os.path.normpath(output_dir))
+    if not os.path.isdir(parent):
+        return None
+    for candidate in sorted(os.listdir(parent), reverse=True):
+        path = os.path.join(parent, candidate)
+        if candidate < name and os.path.isfile(os.path.join(path, FINGERPRINT_FILE)) \
+                and os.path.isdir(os.path.join(path, DAILY_BCOLZ)):
+            return path
+    return None
+
+
+class PreviousDailyBars(object):
+    """
+    上次导入的日线和指纹
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = DailyFingerprints.load(os.path.join(path, FINGERPRINT_FILE))
+        self._table = None
+        self.first_row = dict((int(sid), row) for sid, row in self.table.attrs['first_row'].items())
+        self.last_row = dict((int(sid), row) for sid, row in self.table.attrs['last_row'].items())
+
+    def __getstate__(self):
+        # 传给子进程时不复制已经打开的 bcolz, 在子进程中重新打开
+        state = self.__dict__.copy()
+        state['_table'] = None
+        return state
+
+    @property
+    def table(self):
+        if self._table is None:
+            from bcolz import ctable
+            self._table = ctable(rootdir=os.path.join(self.path, DAILY_BCOLZ), mode='r')
+        return self._table
+
+    def __contains__(self, sid):
+        return sid in self.first_row
+
+    def covers(self, aligner):
+        """
+        :param aligner: 这次导入的 SessionAligner
+        :return: 上次的导入区间与这次开始日期相同, 结束日期不晚于这次
+        """
+        return self.fingerprints.start_date == aligner.first_date and self.fingerprints.end_date <= aligner.last_date
+
+    def get(self, sid):
+        """
+        :return: COMPACT_BAR_DTYPE 结构化数组
+        """
+        start, stop = self.first_row[sid], self.last_row[sid] + 1
+        bars = np.zeros(stop - start, dtype=COMPACT_BAR_DTYPE)
+        for field in COMPACT_BAR_DTYPE.names:
+            bars[field] = self.table[field][start:stop]
+        return bars
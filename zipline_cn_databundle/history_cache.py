@@ -0,0 +1,116 @@
+"""
+本地缓存 tushare 的历史行情, 用于 HistoryFetcher
+
+每个代码一个 npz 文件, 保存 date(YYYYMMDD 整数) 和 open, high, close, low, volume 五列,
+以及上次请求和上次完整下载的时间:
+
+    * 上次请求在 max_age 秒内, 直接使用缓存, 不请求数据源
+    * 否则从缓存的最后日期开始请求, 覆盖缓存中这一天及之后的行情; 最后一天可能是盘中请求到的
+      不完整的日线, 需要重新请求
+    * 上次完整下载超过 full_refresh 秒 (0 表示不限制) 时重新下载全部行情, 以获得数据源对历史数据的修正
+    * offline 模式只使用缓存, 没有缓存的代码跳过
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .tdx.reader import dates_to_int, int_to_datetime64
+
+HISTORY_FIELDS = ('open', 'high', 'close', 'low', 'volume')
+HISTORY_DTYPE = np.dtype([('date', np.int32)] + [(field, np.float64) for field in HISTORY_FIELDS])
+
+
+def history_to_records(history):
+    """
+    :param history: tushare.get_hist_data 格式的 DataFrame, 索引为日期
+    :return: 按日期排序的 HISTORY_DTYPE 结构化数组
+    """
+    history = history.sort_index()
+    records = np.zeros(len(history), dtype=HISTORY_DTYPE)
+    records['date'] = dates_to_int(pd.to_datetime(history.index))
+    for field in HISTORY_FIELDS:
+        records[field] = history[field].values
+    return records
+
+
+def records_to_history(records):
+    index = pd.DatetimeIndex(int_to_datetime64(records['date']).astype('datetime64[ns]'), name='date')
+    return pd.DataFrame(dict((field, records[field]) for field in HISTORY_FIELDS),
+                        index=index, columns=HISTORY_FIELDS)
+
+
+class HistoryCache(object):
+
+    def __init__(self, cache_dir, max_age=12 * 3600, full_refresh=0, offline=False, clock=time.time):
+        """
+        :param max_age: 缓存在多少秒内不需要更新
+        :param full_refresh: 多少秒后重新下载全部行情, 0 表示只追加
+        :param offline: 只使用缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.full_refresh = full_refresh
+        self.offline = offline
+        self.clock = clock
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, symbol):
+        return os.path.join(self.cache_dir, '%s.npz' % symbol)
+
+    def load(self, symbol):
+        """
+        :return: (records, fetched_at, full_at), 没有缓存时返回 (None, 0, 0)
+        """
+        path = self._path(symbol)
+        if not os.path.isfile(path):
+            return None, 0, 0
+        with np.load(path) as data:
+            return data['records'], float(data['fetched_at']), float(data['full_at'])
+
+    def save(self, symbol, records, fetched_at, full_at):
+        path = self._path(symbol)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, records=records, fetched_at=fetched_at, full_at=full_at)
+        os.rename(path + '.tmp', path)
+
+    def lookup(self, symbol):
+        """
+        :return: (records, start), start 为需要请求的第一天 (YYYY-MM-DD, 缓存的最后日期), '' 表示完整下载,
+                 None 表示不需要请求
+        """
+        records, fetched_at, full_at = self.load(symbol)
+        now = self.clock()
+        if self.offline:
+            return records, None
+        if records is None or (self.full_refresh and now - full_at > self.full_refresh):
+            return records, ''
+        if now - fetched_at <= self.max_age:
+            return records, None
+        if len(records) == 0:
+            return records, ''
+        return records, str(int_to_datetime64(records['date'][-1:])[0])
+
+    def update(self, symbol, records, start, history):
+        """
+        保存请求到的行情
+        :param records: lookup 返回的缓存
+        :param start: lookup 返回的 start
+        :param history: 请求到的 DataFrame, None 表示没有新的行情
+        :return: 更新后的结构化数组
+        """
+        now = self.clock()
+        fetched = history_to_records(history) if history is not None and len(history) else \
+            np.zeros(0, dtype=HISTORY_DTYPE)
+        if start == '' or records is None:
+            merged, full_at = fetched, now
+        else:
+            _, _, full_at = self.load(symbol)
+            # 请求到的行情覆盖缓存中同一天及之后的行情, 没有请求到行情时保留缓存
+            if len(fetched):
+                records = records[records['date'] < fetched['date'][0]]
+            merged = np.concatenate([records, fetched])
+        self.save(symbol, merged, now, full_at)
+        return merged
@@ -0,0 +1,235 @@
+"""
+导入过程的计时和性能分析
+
+ingest 的每个环节 (代码列表, 日线索引, 写入基础信息, 解析和写入日线, 除权除息等) 在
+IngestReport.stage 中执行, 记录耗时, CPU 时间, 行数和字节数; 每个代码的日线解析耗时
+单独记录, 用于统计分布和找出最慢的代码
+
+    report = IngestReport(callbacks=[lambda name, stats: print(name, stats['wall'])])
+    with report.stage('asset_db'):
+        asset_db_writer.write(symbol_df)
+    report.save('/tmp/ingest.json')
+
+squant_bundle 设置 SQUANT_REPORT, SQUANT_PROFILE 后自动生成报告和 cProfile 结果,
+用 squant-ingest-report /tmp/ingest.json 查看
+
+CPU 时间只包括当前进程, 多进程解析日线时子进程的 CPU 时间不在其中
+
+daily_bars 中解析和写入交替进行, 其中的各部分作为嵌套的环节单独记录, 不计入总耗时:
+
+    daily_source    writer 等待下一个代码的时间, daily_bars 减去它为 writer 的时间
+    tdx_decode      读取通达信日线文件
+    align           对齐到交易日
+    previous_bars   skip_unchanged 模式读取上次导入的日线
+    fingerprint     skip_unchanged 模式计算文件指纹
+
+多进程解析时 tdx_decode 等为所有子进程的累计耗时, 可能超过 daily_bars
+"""
+import cProfile
+import heapq
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import click
+import numpy as np
+
+# 单个代码解析耗时分布的分界, 单位为毫秒
+SYMBOL_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def bars_nbytes(bars):
+    """
+    :param bars: 日线 DataFrame 或 compact 模式的结构化数组
+    :return: 占用的内存字节数, 包括 DataFrame 的索引
+    """
+    if isinstance(bars, np.ndarray):
+        return bars.nbytes
+    return int(bars.memory_usage(index=True).sum())
+
+
+class IngestReport(object):
+
+    def __init__(self, callbacks=None, slowest=20):
+        """
+        :param callbacks: 每个环节结束后调用 callback(name, stats), stats 为该环节的累计统计
+        :param slowest: 报告中保留解析最慢的代码个数
+        """
+        self.callbacks = list(callbacks or [])
+        self.slowest = slowest
+        self.stages = OrderedDict()
+        self.nested = set()
+        self.symbol_seconds = []
+        self._slowest_symbols = []
+        self.started = time.time()
+
+    def _stats(self, name):
+        if name not in self.stages:
+            self.stages[name] = OrderedDict([
+                ('calls', 0), ('wall', 0.0), ('cpu', 0.0), ('rows', 0), ('bytes', 0),
+            ])
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """
+        统计 with 语句中的耗时, 同一个环节多次执行时累加
+        """
+        stats = self._stats(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stats
+        finally:
+            stats['calls'] += 1
+            stats['wall'] += time.perf_counter() - wall
+            stats['cpu'] += time.process_time() - cpu
+            for callback in self.callbacks:
+                callback(name, stats)
+
+    def add(self, name, rows=0, nbytes=0):
+        """
+        累加环节处理的行数和字节数
+        """
+        stats = self._stats(name)
+        stats['rows'] += int(rows)
+        stats['bytes'] += int(nbytes)
+
+    def add_seconds(self, name, seconds):
+        """
+        累加其他环节内部一部分的耗时, 作为嵌套的环节记录, 不计入总耗时
+        """
+        stats = self._stats(name)
+        stats['calls'] += 1
+        stats['wall'] += seconds
+        self.nested.add(name)
+
+    def timed_iter(self, name, iterable):
+        """
+        逐个产生 iterable 的元素, 每次取下一个元素的耗时累加到嵌套的环节 name 中,
+        用于从 writer.write(iterable) 的耗时中区分 writer 和数据源
+        """
+        stats = self._stats(name)
+        self.nested.add(name)
+        iterator = iter(iterable)
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                stats['wall'] += time.perf_counter() - wall
+                stats['cpu'] += time.process_time() - cpu
+            stats['calls'] += 1
+            yield item
+
+    def add_symbol(self, sid, code, seconds):
+        """
+        记录一个代码的日线解析和对齐耗时
+        :param code: 代码, 如 sh600000
+        """
+        self.symbol_seconds.append(seconds)
+        item = (seconds, int(sid), code)
+        if len(self._slowest_symbols) < self.slowest:
+            heapq.heappush(self._slowest_symbols, item)
+        elif item > self._slowest_symbols[0]:
+            heapq.heapreplace(self._slowest_symbols, item)
+
+    def symbol_histogram(self):
+        """
+        :return: [(上界毫秒, 个数)], 最后一个上界为 None 表示超过最大分界
+        """
+        edges = np.array(SYMBOL_LATENCY_BUCKETS_MS, dtype=np.float64) / 1000
+        counts = np.bincount(np.searchsorted(edges, self.symbol_seconds, side='right'),
+                             minlength=len(edges) + 1)
+        return list(zip(list(SYMBOL_LATENCY_BUCKETS_MS) + [None], counts.tolist()))
+
+    def to_dict(self):
+        seconds = np.array(self.symbol_seconds, dtype=np.float64)
+        symbols = OrderedDict([('count', len(seconds))])
+        if len(seconds):
+            symbols['total'] = seconds.sum()
+            symbols['mean'] = seconds.mean()
+            symbols['p50'], symbols['p90'], symbols['p99'] = np.percentile(seconds, [50, 90, 99]).tolist()
+            symbols['max'] = seconds.max()
+        symbols['histogram_ms'] = [{'le': le, 'count': count} for le, count in self.symbol_histogram()]
+        symbols['slowest'] = [{'sid': sid, 'code': code, 'seconds': s}
+                              for s, sid, code in sorted(self._slowest_symbols, reverse=True)]
+
+        top = [stats for name, stats in self.stages.items() if name not in self.nested]
+        return OrderedDict([
+            ('started', self.started),
+            ('wall', sum(stats['wall'] for stats in top)),
+            ('cpu', sum(stats['cpu'] for stats in top)),
+            ('stages', self.stages),
+            ('nested', [name for name in self.stages if name in self.nested]),
+            ('symbols', symbols),
+        ])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=float)
+
+    @contextmanager
+    def profile(self, path=None):
+        """
+        path 不为空时用 cProfile 分析 with 语句中的代码, 结束后写入 path,
+        可以用 python -m pstats path 或 snakeviz 查看
+        """
+        if not path:
+            yield None
+            return
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            directory = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            profiler.dump_stats(path)
+
+
+@click.command()
+@click.argument("report_path")
+@click.option("--profile", default=None, help="also print the top functions of this cProfile dump")
+@click.option("--top", default=20, help="number of profile functions to print")
+def ingest_report(report_path, profile, top):
+    """
+    打印 SQUANT_REPORT 生成的导入报告
+    """
+    with open(report_path) as f:
+        report = json.load(f, object_pairs_hook=OrderedDict)
+
+    click.echo("%-18s %6s %10s %10s %12s %10s" % ("stage", "calls", "wall", "cpu", "rows", "MB"))
+    nested = set(report.get('nested', []))
+    for name, stats in report['stages'].items():
+        click.echo("%-18s %6d %9.3fs %9.3fs %12d %10.1f" % (
+            "  " + name if name in nested else name, stats['calls'], stats['wall'], stats['cpu'], stats['rows'],
+            stats['bytes'] / 1e6))
+    click.echo("%-18s %6s %9.3fs %9.3fs" % ("total", "", report['wall'], report['cpu']))
+    if 'daily_bars' in report['stages'] and 'daily_source' in report['stages']:
+        daily_bars, daily_source = report['stages']['daily_bars'], report['stages']['daily_source']
+        click.echo("daily_bar_writer: %.3fs wall, %.3fs cpu" % (daily_bars['wall'] - daily_source['wall'],
+                                                              daily_bars['cpu'] - daily_source['cpu']))
+
+    symbols = report['symbols']
+    if symbols['count']:
+        click.echo("\n%d symbols decoded, mean %.1fms, p90 %.1fms, p99 %.1fms, max %.1fms" % (
+            symbols['count'], symbols['mean'] * 1000, symbols['p90'] * 1000, symbols['p99'] * 1000,
+            symbols['max'] * 1000))
+        for bucket in symbols['histogram_ms']:
+            label = "<= %dms" % bucket['le'] if bucket['le'] is not None else "> %dms" % SYMBOL_LATENCY_BUCKETS_MS[-1]
+            click.echo("  %-10s %d" % (label, bucket['count']))
+        click.echo("slowest:")
+        for item in symbols['slowest']:
+            click.echo("  %-10s sid=%-6d %.1fms" % (item['code'], item['sid'], item['seconds'] * 1000))
+
+    if profile:
+        import pstats
+        click.echo("")
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(top)
@@ -0,0 +1,60 @@
+"""
+多进程, 多线程执行工具
+"""
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def ordered_imap(func, iterable, processes=None, max_inflight=None, initializer=None, initargs=()):
+    """
+    在进程池中执行 func(*args), 按 iterable 的顺序逐个返回结果
+
+    与 Pool.imap 不同, 同时提交但还没被取走的任务不超过 max_inflight 个,
+    消费者(比如 daily_bar_writer)较慢时不会在内存中堆积结果
+
+    :param func: 模块级函数, 需要可以被 pickle
+    :param iterable: 参数元组的迭代器
+    :param processes: 进程数, None 表示 cpu 个数
+    :param max_inflight: 最多同时在执行或等待取走的任务数, 默认为进程数的 2 倍
+    """
+    processes = processes or multiprocessing.cpu_count()
+    max_inflight = max(max_inflight or processes * 2, 1)
+
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    try:
+        pending = deque()
+        for args in iterable:
+            pending.append(pool.apply_async(func, args))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def ordered_thread_imap(func, iterable, threads, max_inflight=None):
+    """
+    与 ordered_imap 相同, 但在线程池中执行, 适合网络请求等 IO 密集的任务, func 不需要可以被 pickle
+
+    :param threads: 线程数
+    :param max_inflight: 最多同时在执行或等待取走的任务数, 默认为线程数的 2 倍
+    """
+    max_inflight = max(max_inflight or threads * 2, 1)
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+    try:
+        pending = deque()
+        for args in iterable:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,121 @@
+"""
+分片导入
+
+全市场的分钟线和完整历史日线在一台机器上导入太慢时, 按 sid 取模把代码列表分成 N 片,
+每片在不同的机器或进程上解析通达信文件并保存到共享目录, 最后由 squant_bundle 合并写入:
+
+    squant-ingest-shard --shards 4 --shard 0 --start 2005-01-04 --end 2017-06-30 --output /nfs/shards
+    ...
+    squant-ingest-shard --shards 4 --shard 3 --start 2005-01-04 --end 2017-06-30 --output /nfs/shards
+    SQUANT_SHARD_DIR=/nfs/shards zipline ingest -b squant
+
+不指定 --shard 时在本机用多个进程导入所有分片. 各分片和合并时的代码列表, 日期区间,
+compact 和分钟线设置必须相同, 合并前会检查; sid 由代码列表决定, 所以各分片的 sid 一致,
+除权除息数据在合并时一次写入
+"""
+import multiprocessing
+import os
+
+import click
+import pandas as pd
+
+from .ingest_report import IngestReport
+from .spool import ShardSpool
+from .squant_config import SquantConfig
+from .squant_source import (
+    TdxReader,
+    get_symbol_list,
+    load_symbols,
+    open_tdx_reader,
+    filter_symbols,
+    tdx_exchanges,
+    tdx_date_ranges,
+    get_tdx_hist_data,
+    get_minute_data,
+    shard_params,
+    shard_symbol_map,
+)
+
+
+def ingest_shard(config, symbol_list, calendar, start_session, end_session, shard, num_shards, output_dir):
+    """
+    解析一个分片的日线和分钟线, 保存到 output_dir/shard-xxxx-of-xxxx
+    :param config: SquantConfig
+    :param symbol_list: 返回代码列表的函数, 所有分片必须返回相同的代码列表
+    :return: ShardSpool
+    """
+    report = IngestReport()
+    symbol_df, symbol_map = load_symbols(symbol_list, start_session, end_session)
+    spool = ShardSpool.create(output_dir, shard, num_shards,
+                              shard_params(config, start_session, end_session, symbol_map))
+
+    tdx_reader, tdx_index = open_tdx_reader(config, report)
+    # 合并时用各分片中代码的首末日期生成 asset_db, 与不分片导入时相同
+    shard_map = shard_symbol_map(symbol_map, shard, num_shards)
+    spool.set_date_ranges(tdx_date_ranges(tdx_index, tdx_exchanges(symbol_df, shard_map) + shard_map.values))
+
+    hist_symbol_map = filter_symbols(config, symbol_df, symbol_map, tdx_index, start_session, end_session)
+    hist_symbol_map = shard_symbol_map(hist_symbol_map, shard, num_shards)
+    hist_data = get_tdx_hist_data(config, symbol_df, hist_symbol_map, tdx_reader, start_session, end_session,
+                                  calendar, report)
+    with report.stage('daily_bars'):
+        spool.write_all('daily', report.timed_iter('daily_source', hist_data))
+
+    if config.minute:
+        minute_reader = TdxReader(config.tdx_dir, mmap=True)
+        with report.stage('minute_bars'):
+            spool.write_all('minute', get_minute_data(symbol_df, shard_map, minute_reader, start_session,
+                                                      end_session, calendar, freq=config.minute, report=report))
+
+    spool.finish()
+    report.save(os.path.join(spool.path, 'report.json'))
+    return spool
+
+
+def _ingest_shard_worker(args):
+    return ingest_shard(*args).path
+
+
+def ingest_shards(config, symbol_list, calendar, start_session, end_session, num_shards, output_dir,
+                  processes=None):
+    """
+    在本机用进程池导入所有分片, 每个分片在一个进程中解析
+    :return: 分片目录列表
+    """
+    # 进程池中的进程不能再创建子进程
+    options = dict(config.options, processes=0)
+    shard_config = SquantConfig(environ=config.environ, **options)
+    tasks = [(shard_config, symbol_list, calendar, start_session, end_session, shard, num_shards, output_dir)
+             for shard in range(num_shards)]
+
+    pool = multiprocessing.Pool(processes or min(num_shards, multiprocessing.cpu_count()))
+    try:
+        return pool.map(_ingest_shard_worker, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+@click.command()
+@click.option("--shards", type=int, required=True, help="total number of shards")
+@click.option("--shard", type=int, default=None, help="shard to ingest, all shards in local processes if omitted")
+@click.option("--start", required=True, help="first session, same as the bundle's start_session")
+@click.option("--end", required=True, help="last session, same as the bundle's end_session")
+@click.option("--output", required=True, help="shard directory, used as SQUANT_SHARD_DIR when merging")
+@click.option("--processes", type=int, default=None, help="local processes when ingesting all shards")
+def ingest_shard_command(shards, shard, start, end, output, processes):
+    from cn_stock_holidays.zipline.default_calendar import shsz_calendar
+
+    config = SquantConfig()
+    start_session, end_session = pd.Timestamp(start, tz='UTC'), pd.Timestamp(end, tz='UTC')
+    if shard is None:
+        paths = ingest_shards(config, get_symbol_list, shsz_calendar, start_session, end_session, shards, output,
+                              processes=processes)
+    else:
+        if not 0 <= shard < shards:
+            raise click.BadParameter("shard must be in [0, %d)" % shards)
+        paths = [ingest_shard(config, get_symbol_list, shsz_calendar, start_session, end_session, shard, shards,
+                              output).path]
+    for path in paths:
+        click.echo("%s: %d daily, %d minute" % (path, len(ShardSpool(path).sids('daily')),
+                                                 len(ShardSpool(path).sids('minute'))))
@@ -0,0 +1,213 @@
+"""
+分片导入的中间结果
+
+每个分片把对齐后的日线和分钟线按 sid 保存为单独的文件, 合并时按 sid 顺序读回交给 writer
+
+    shard-0000-of-0004/
+        manifest.json       分片编号, 导入参数, 已完成的 sid, 分片内代码日线文件的首末日期
+        daily/<sid>.npy     compact 模式的结构化数组
+        daily/<sid>.npz     DataFrame 的索引和各列
+        minute/<sid>.npz
+"""
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+SHARD_DIR_FORMAT = 'shard-%04d-of-%04d'
+
+
+class ShardMismatchException(Exception):
+    pass
+
+
+def save_bars(path, bars):
+    """
+    保存一个代码的日线或分钟线, 先写临时文件再改名
+    :param path: 不带扩展名的路径
+    :param bars: 结构化数组保存为 .npy, DataFrame 保存为 .npz
+    :return: 保存的文件名
+    """
+    if isinstance(bars, np.ndarray):
+        fname = path + '.npy'
+    else:
+        fname = path + '.npz'
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as f:
+        if isinstance(bars, np.ndarray):
+            np.save(f, bars)
+        else:
+            arrays = dict(('column_%d' % i, bars[column].values) for i, column in enumerate(bars.columns))
+            np.savez(f,
+                     index=bars.index.values.astype('datetime64[ns]'),
+                     tz=np.array(str(bars.index.tz) if bars.index.tz is not None else ''),
+                     columns=np.array([str(column) for column in bars.columns]),
+                     **arrays)
+    os.rename(tmp, fname)
+    return fname
+
+
+def load_bars(fname):
+    """
+    读取 save_bars 保存的文件
+    """
+    if fname.endswith('.npy'):
+        return np.load(fname)
+
+    with np.load(fname) as data:
+        tz = str(data['tz'])
+        index = pd.DatetimeIndex(data['index'])
+        if tz:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        columns = [str(column) for column in data['columns']]
+        return pd.DataFrame(
+            dict((column, data['column_%d' % i]) for i, column in enumerate(columns)),
+            index=index,
+            columns=columns,
+        )
+
+
+class ShardSpool(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.manifest = {}
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    @classmethod
+    def create(cls, root, shard, num_shards, params):
+        """
+        创建一个空的分片目录, 已经存在时清空
+        :param params: 导入参数, 合并时所有分片必须相同
+        """
+        path = os.path.join(root, SHARD_DIR_FORMAT % (shard, num_shards))
+        for kind in ('daily', 'minute'):
+            directory = os.path.join(path, kind)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for fname in glob.glob(os.path.join(directory, '*')):
+                os.remove(fname)
+
+        spool = cls(path)
+        spool.manifest = {
+            'shard': shard,
+            'num_shards': num_shards,
+            'params': params,
+            'complete': False,
+            'daily': {},
+            'minute': {},
+        }
+        spool.save()
+        return spool
+
+    @property
+    def complete(self):
+        return self.manifest.get('complete', False)
+
+    @property
+    def params(self):
+        return self.manifest.get('params')
+
+    def save(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.rename(tmp, self.manifest_path)
+
+    def write(self, kind, sid, bars):
+        """
+        :param kind: daily 或 minute
+        """
+        fname = save_bars(os.path.join(self.path, kind, str(sid)), bars)
+        self.manifest[kind][str(sid)] = os.path.basename(fname)
+
+    def write_all(self, kind, data):
+        """
+        写入 get_hist_data, get_minute_data 产生的所有 (sid, bars)
+        :return: 写入的代码个数
+        """
+        count = 0
+        for sid, bars in data:
+            self.write(kind, sid, bars)
+            count += 1
+        return count
+
+    def finish(self):
+        self.manifest['complete'] = True
+        self.save()
+
+    def set_date_ranges(self, date_ranges):
+        """
+        :param date_ranges: {'sh600000': (first_date, last_date)}, 合并时用于生成 asset_db 的起止日期
+        """
+        self.manifest['date_ranges'] = dict((key, [int(first), int(last)])
+                                            for key, (first, last) in date_ranges.items())
+
+    def sids(self, kind):
+        return sorted(int(sid) for sid in self.manifest.get(kind, {}))
+
+    def read(self, kind, sid):
+        return load_bars(os.path.join(self.path, kind, self.manifest[kind][str(sid)]))
+
+
+def open_shards(root, params=None):
+    """
+    打开 root 下所有分片, 检查分片是否齐全, 是否都已完成, 导入参数是否相同
+    :param params: None 时不检查导入参数, 之后需要调用 check_shard_params
+    :return: 按分片编号排序的 ShardSpool 列表
+    """
+    spools = [ShardSpool(path) for path in sorted(glob.glob(os.path.join(root, 'shard-*-of-*')))]
+    if not spools:
+        raise ShardMismatchException("no shard found in %s" % root)
+
+    num_shards = spools[0].manifest.get('num_shards')
+    shards = sorted(spool.manifest.get('shard') for spool in spools)
+    if shards != list(range(num_shards)) or any(spool.manifest.get('num_shards') != num_shards
+                                                for spool in spools):
+        raise ShardMismatchException("expect shards 0..%s in %s, found %s" % (num_shards, root, shards))
+
+    for spool in spools:
+        if not spool.complete:
+            raise ShardMismatchException("shard %s is not complete" % spool.path)
+    if params is not None:
+        check_shard_params(spools, params)
+    return spools
+
+
+def check_shard_params(spools, params):
+    for spool in spools:
+        if spool.params != params:
+            raise ShardMismatchException("shard %s was ingested with %s, expect %s" % (
+                spool.path, spool.params, params))
+
+
+def merge_date_ranges(spools):
+    """
+    :return: 所有分片记录的 {'sh600000': (first_date, last_date)}
+    """
+    date_ranges = {}
+    for spool in spools:
+        if 'date_ranges' not in spool.manifest:
+            raise ShardMismatchException("shard %s has no date ranges, please ingest it again" % spool.path)
+        date_ranges.update((key, tuple(dates)) for key, dates in spool.manifest['date_ranges'].items())
+    return date_ranges
+
+
+def merge_shards(spools, kind):
+    """
+    按 sid 顺序产生所有分片中的 (sid, bars), 每次只读取一个代码
+    """
+    owner = {}
+    for spool in spools:
+        for sid in spool.sids(kind):
+            if sid in owner:
+                raise ShardMismatchException("sid %d found in both %s and %s" % (sid, owner[sid].path, spool.path))
+            owner[sid] = spool
+
+    for sid in sorted(owner):
+        yield sid, owner[sid].read(kind, sid)
@@ -0,0 +1,134 @@
+"""
+squant_bundle 的配置
+
+导入模块时不读取环境变量也不检查文件, 没有在构造时传入的参数, 在导入数据第一次用到时
+才从 zipline 传给 bundle 的 environ (默认为 os.environ) 中读取
+"""
+import os
+
+# 参数名 => (环境变量, 默认值)
+SQUANT_ENVIRON = {
+    # 通达信 vipdoc 目录
+    'tdx_dir': ('TDX_DIR', None),
+    # 沪深除权除息文件
+    'cqcx_sh': ('CQCX_SH', None),
+    'cqcx_sz': ('CQCX_SZ', None),
+    # 多进程解析日线的进程数, 不设置或为 0 时在当前进程中逐个解析
+    'processes': ('SQUANT_PROCESSES', None),
+    # 多进程模式下最多同时在处理或等待写入的代码数, 默认为进程数的 2 倍
+    'max_inflight': ('SQUANT_MAX_INFLIGHT', None),
+    # tdx-build-store 生成的列式存储, 设置后日线优先从存储中读取
+    'tdx_store': ('TDX_STORE', None),
+    # tdx-validate 生成的隔离列表, 其中的代码不会被导入
+    'quarantine': ('TDX_QUARANTINE', None),
+    # 设置为 1 时日线以 uint32 从解析一直保持到 writer, 不经过 float64 DataFrame
+    'compact': ('SQUANT_COMPACT', None),
+    # 设置为 1 时保存每个代码的日线指纹, 下次导入时直接复制上次 bundle 中没有变化的日线, 只对齐新追加的记录,
+    # 用于每天的增量导入; 可以与 SQUANT_PROCESSES 同时使用, 不能与 SQUANT_CHECKPOINT 和 SQUANT_SHARD_DIR 同时使用
+    'skip_unchanged': ('SQUANT_SKIP_UNCHANGED', None),
+    # 设置后同时写入分钟线, 1m 读取 minline/*.lc1, 5m 读取 fzline/*.lc5
+    'minute': ('TDX_MINUTE', None),
+    # 设置为 1 时把对齐后的日线保存到 zipline 的 cache 中, 导入失败后再次导入时跳过已经保存的代码
+    'checkpoint': ('SQUANT_CHECKPOINT', None),
+    # squant-ingest-shard 的输出目录, 设置后不再读取通达信文件, 合并各分片的日线和分钟线
+    'shard_dir': ('SQUANT_SHARD_DIR', None),
+    # 导入结束后把各环节耗时, 行数, 最慢的代码等写入这个 json 文件
+    'report': ('SQUANT_REPORT', None),
+    # 设置后用 cProfile 分析整个导入过程, 结果写入这个文件
+    'profile': ('SQUANT_PROFILE', None),
+    # 解析后的除权除息数据缓存目录, 设置为空字符串时不使用缓存, 默认在 ~/.zipline_cn_databundle/cqcx
+    'cqcx_cache': ('SQUANT_CQCX_CACHE', None),
+}
+
+
+class SquantConfig(object):
+
+    def __init__(self, environ=None, **options):
+        """
+        :param environ: 读取没有传入的参数的环境变量, None 表示 os.environ
+        :param options: SQUANT_ENVIRON 中的参数, 值为 None 时从环境变量读取
+        """
+        unknown = set(options) - set(SQUANT_ENVIRON)
+        if unknown:
+            raise TypeError('unknown squant options: %s' % ', '.join(sorted(unknown)))
+        self.environ = environ
+        self.options = options
+
+    def get(self, name):
+        value = self.options.get(name)
+        if value is None:
+            env_name, default = SQUANT_ENVIRON[name]
+            environ = os.environ if self.environ is None else self.environ
+            value = environ.get(env_name, default)
+        return value
+
+    @property
+    def tdx_dir(self):
+        tdx_dir = self.get('tdx_dir')
+        if not tdx_dir:
+            raise Exception("Please Setting TDX data dir")
+        return tdx_dir
+
+    @property
+    def cqcx_list(self):
+        cqcx_sh, cqcx_sz = self.get('cqcx_sh'), self.get('cqcx_sz')
+        if not cqcx_sh or not cqcx_sz:
+            raise Exception("need set cqcx file on CQCX_SH CQCX_SZ")
+
+        if not os.path.isfile(cqcx_sh) \
+            or not os.path.isfile(cqcx_sz):
+            raise Exception("setting CQCX_SH, CQCX_SZ path is not correct")
+        return cqcx_sh, cqcx_sz
+
+    @property
+    def processes(self):
+        return int(self.get('processes') or 0)
+
+    @property
+    def max_inflight(self):
+        return int(self.get('max_inflight') or 0)
+
+    @property
+    def compact(self):
+        # 复制上次的日线时只能使用与 bcolz 相同的 uint32 格式
+        return bool(int(self.get('compact') or 0)) or self.skip_unchanged
+
+    @property
+    def skip_unchanged(self):
+        return bool(int(self.get('skip_unchanged') or 0))
+
+    @property
+    def tdx_store(self):
+        return self.get('tdx_store')
+
+    @property
+    def quarantine(self):
+        return self.get('quarantine')
+
+    @property
+    def minute(self):
+        return self.get('minute')
+
+    @property
+    def checkpoint(self):
+        return bool(int(self.get('checkpoint') or 0))
+
+    @property
+    def shard_dir(self):
+        return self.get('shard_dir')
+
+    @property
+    def report(self):
+        return self.get('report')
+
+    @property
+    def profile(self):
+        return self.get('profile')
+
+    @property
+    def cqcx_cache(self):
+        cqcx_cache = self.get('cqcx_cache')
+        if cqcx_cache is None:
+            from .all_stocks import get_cache_dir
+            cqcx_cache = os.path.join(get_cache_dir(), 'cqcx')
+        return cqcx_cache
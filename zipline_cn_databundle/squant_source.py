@@ -1,8 +1,18 @@
-from squant.data.stock import file_parser
-from squant.zipline.datasource import get_symbol_list
-import os
-import datetime
-from .tdx.reader import TdxReader, TdxFileNotFoundException
+import time
+import hashlib
+from .tdx.reader import TdxReader, TdxFileNotFoundException, minute_records_to_df, date_to_int, int_to_datetime64
+from .tdx.incremental import file_stat
+from .tdx.validate import load_quarantine
+from .parallel import ordered_imap
+from .align import SessionAligner, COMPACT_BAR_DTYPE
+from .cqcx_cache import CqcxCache, cqcx_to_frame
+from .squant_config import SquantConfig
+from .ingest_report import IngestReport, bars_nbytes
+from .checkpoint import IngestCheckpoint
+from .spool import open_shards, check_shard_params, merge_shards, merge_date_ranges
+from .fingerprint import DailyFingerprints, PreviousDailyBars, find_previous_ingestion, fingerprint_entry, \
+    appended_entry, read_appended_records
+import numpy as np
 import pandas as pd
 
 """
@@ -13,168 +23,670 @@ That read data from binary files
 via RainX<i@rainx.cn>
 
 ipython 3 only
+
+squant 只在导入数据时才会被 import, 目录和文件通过 SquantConfig 在导入时读取,
+需要设定沪深除权除息文件 CQCX_SH, CQCX_SZ 和通达信目录 TDX_DIR
 """
 
+# zipline 交易所 => 通达信目录
+EXCHANGE_TO_TDX = {
+    'SZSE': 'sz',
+    'SSE': 'sh',
+}
 
-# 需要设定沪深文件目录
-CQCX_SH = os.environ.get("CQCX_SH")
-CQCX_SZ = os.environ.get("CQCX_SZ")
+def get_symbol_list():
+    from squant.zipline.datasource import get_symbol_list
+    return get_symbol_list()
 
-TDX_DIR = os.environ.get("TDX_DIR")
+def parse_cqcx(path):
+    from squant.data.stock import file_parser
+    return file_parser.get_cqcx(path.encode("utf-8"))
 
-if not CQCX_SH or not CQCX_SZ:
-    raise Exception("need set cqcx file on CQCX_SH CQCX_SZ")
+def load_cqcx_tables(config=None, parser=parse_cqcx):
+    """
+    读取 CQCX_SH, CQCX_SZ, 文件没有变化时使用 config.cqcx_cache 中的缓存
+    :param parser: 解析除权除息文件的函数
+    :return: DataFrame 列表
+    """
+    config = config or SquantConfig()
+    if not config.cqcx_cache:
+        return [cqcx_to_frame(parser(CQCX)) for CQCX in config.cqcx_list]
 
-if not os.path.isfile(CQCX_SH) \
-    or not os.path.isfile(CQCX_SZ):
-    raise Exception("setting CQCX_SH, CQCX_SZ path is not correct")
+    cache = CqcxCache(config.cqcx_cache)
+    return [cache.load(CQCX, parser) for CQCX in config.cqcx_list]
 
+def load_splits_and_dividends(cqcx_data=None, config=None):
+    """
+    获取所有除权出息的信息, 根据zipline平台的特点,忽略配股信息
+    :param cqcx_data: 已经解析的除权除息记录列表, 每个元素对应一个文件, None 时解析 CQCX_SH, CQCX_SZ
+    :param config: SquantConfig, None 时从环境变量读取
+    :return: (splits, dividends)
+        splits: DataFrame, 列为 stock(整数代码), effective_date, ratio
+        dividends: DataFrame, 列为 stock(整数代码), ex_date, amount
+    """
+    if cqcx_data is None:
+        cqcx_data = load_cqcx_tables(config)
+
+    cqcx = pd.concat([cqcx_to_frame(data) for data in cqcx_data], ignore_index=True)
+    stock = cqcx['stock'].values.astype('int64')
+    dates = pd.DatetimeIndex(int_to_datetime64(cqcx['date'].values).astype('datetime64[ns]'))
+    sg_val = cqcx['sgVal'].values.astype('float64')
+    px_val = cqcx['pxVal'].values.astype('float64')
+
+    # sgVal 送股数，每1000股送股数
+    is_split = sg_val != 0
+    splits = pd.DataFrame({
+        'stock': stock[is_split],
+        'effective_date': dates[is_split],
+        'ratio': 1000 / (1000 + sg_val[is_split]),
+    }, columns=['stock', 'effective_date', 'ratio'])
+
+    is_dividend = px_val != 0
+    dividends = pd.DataFrame({
+        'stock': stock[is_dividend],
+        'ex_date': dates[is_dividend],
+        'amount': px_val[is_dividend] / 1000,
+    }, columns=['stock', 'ex_date', 'amount'])
 
-if not TDX_DIR:
-    raise Exception("Please Setting TDX data dir")
+    return splits, dividends
 
-CQCX_LIST = (CQCX_SH, CQCX_SZ)
 
-def load_splits_and_dividends():
+def zipline_splits_and_dividends(symbol_map, cqcx_data=None, config=None):
     """
-    获取所有除权出息的信息, 根据zipline平台的特点,忽略配股信息
-    :return:
-    """
-
-    splits = {}
-    dividends = {}
-
-    for CQCX in CQCX_LIST:
-        cqcx_data = file_parser.get_cqcx(CQCX.encode("utf-8"))
-        for row in cqcx_data:
-            code = str(row['stock']).zfill(6)
-            # sgVal 送股数，每1000股送股数
-            if row['sgVal'] != 0:
-                if code not in splits.keys():
-                    splits[code] = []
-                splits[code].append({
-                    'effective_date' : int_to_date(row['date']),
-                    'ratio' : 1000 / (1000 + row['sgVal']),
-                })
-
-            if row['pxVal'] != 0:
-                if code not in dividends.keys():
-                    dividends[code] = []
-                dividends[code].append({
-                    'amount' : row['pxVal'] / 1000,
-                    'ex_date' : int_to_date(row['date']),
-                })
+    :param symbol_map: sid => 6 位代码的 Series
+    :return: (splits, dividends) 两个 DataFrame, 格式与 adjustment_writer.write 的参数相同
+    """
+    raw_splits, raw_dividends = load_splits_and_dividends(cqcx_data, config)
 
+    # 除权除息表中的代码是整数, 与 symbol_map 关联一次得到 sid
+    sids = pd.DataFrame({
+        'sid': symbol_map.index.values.astype('int64'),
+        'stock': pd.to_numeric(symbol_map.values, errors='coerce'),
+    }).dropna()
+    sids['stock'] = sids['stock'].astype('int64')
 
-    return splits, dividends
+    splits = raw_splits.merge(sids, on='stock', sort=False)
+    splits = splits.sort_values(['sid', 'effective_date'], kind='mergesort')
+    splits = splits[['effective_date', 'ratio', 'sid']].reset_index(drop=True)
 
+    dividends = raw_dividends.merge(sids, on='stock', sort=False)
+    dividends = dividends.sort_values(['sid', 'ex_date'], kind='mergesort')
+    dividends = dividends[['amount', 'ex_date', 'sid']].reset_index(drop=True)
+    dividends['record_date'] = dividends['declared_date'] = dividends['pay_date'] = pd.NaT
 
-def zipline_splits_and_dividends(symbol_map):
-    raw_splits, raw_dividends = load_splits_and_dividends()
-    splits = []
-    dividends = []
-    for sid, code in symbol_map.iteritems():
-        if code in raw_splits:
-            split = pd.DataFrame(data=raw_splits[code])
-            split['sid'] = sid
-            split.index = split['effective_date'] = pd.DatetimeIndex(split['effective_date'])
-            splits.append(split)
-        if code in raw_dividends:
-            dividend = pd.DataFrame(data = raw_dividends[code])
-            dividend['sid'] = sid
-            dividend['record_date'] = dividend['declared_date'] = dividend['pay_date'] = pd.NaT
-            dividend.index = dividend['ex_date'] = pd.DatetimeIndex(dividend['ex_date'])
-            dividends.append(dividend)
     return splits, dividends
 
-def int_to_date(d):
-    d = str(d)
-    return datetime.date(int(d[:4]), int(d[4:6]), int(d[6:]))
+def make_squant_bundle(tdx_dir=None, cqcx=None, symbol_list=None, cqcx_parser=None, report_callbacks=None,
+                       **options):
+    """
+    生成 squant bundle 的 ingest 函数, 可以用不同的数据快照注册多个 bundle
 
+        register('cn_squant_2016', make_squant_bundle(tdx_dir='/data/2016/vipdoc',
+                                                      cqcx=('/data/2016/CQCX_SH', '/data/2016/CQCX_SZ')))
 
-def squant_bundle(environ,
-                   asset_db_writer,
-                   minute_bar_writer,
-                   daily_bar_writer,
-                   adjustment_writer,
-                   calendar,
-                   start_session,
-                   end_session,
-                   cache,
-                   show_progress,
-                   output_dir):
+    :param tdx_dir: 通达信 vipdoc 目录, None 时读取 TDX_DIR
+    :param cqcx: (沪市, 深市) 除权除息文件, None 时读取 CQCX_SH, CQCX_SZ
+    :param symbol_list: 返回代码列表的函数, 默认为 squant 的 get_symbol_list
+    :param cqcx_parser: 解析除权除息文件的函数, 参数为文件路径, 默认为 squant 的 file_parser.get_cqcx
+    :param report_callbacks: 每个导入环节结束后调用的函数列表, 参数为 (环节名, 统计), 见 IngestReport
+    :param options: 其他 SquantConfig 参数, 如 processes, compact
+    """
+    if cqcx is not None:
+        options['cqcx_sh'], options['cqcx_sz'] = cqcx
+    options['tdx_dir'] = tdx_dir
+    # 检查参数名
+    SquantConfig(**options)
+
+    def ingest(environ,
+               asset_db_writer,
+               minute_bar_writer,
+               daily_bar_writer,
+               adjustment_writer,
+               calendar,
+               start_session,
+               end_session,
+               cache,
+               show_progress,
+               output_dir):
+        config = SquantConfig(environ=environ, **options)
+        report = IngestReport(callbacks=report_callbacks)
+        with report.profile(config.profile):
+            ingest_squant(config,
+                          symbol_list or get_symbol_list,
+                          cqcx_parser or parse_cqcx,
+                          asset_db_writer,
+                          minute_bar_writer,
+                          daily_bar_writer,
+                          adjustment_writer,
+                          calendar,
+                          start_session,
+                          end_session,
+                          show_progress,
+                          report=report,
+                          cache=cache,
+                          output_dir=output_dir)
+        if config.report:
+            report.save(config.report)
+
+    return ingest
+
+
+def ingest_squant(config,
+                  symbol_list,
+                  cqcx_parser,
+                  asset_db_writer,
+                  minute_bar_writer,
+                  daily_bar_writer,
+                  adjustment_writer,
+                  calendar,
+                  start_session,
+                  end_session,
+                  show_progress,
+                  report=None,
+                  cache=None,
+                  output_dir=None):
+    """
+    :param report: IngestReport, 记录每个环节的耗时
+    :param cache: zipline 的 dataframe_cache, config.checkpoint 为 True 时保存检查点
+    :param output_dir: zipline 的 bundle 目录, config.skip_unchanged 为 True 时保存指纹, 并查找上次的导入
+    """
+    report = report or IngestReport()
+    if config.skip_unchanged and (config.checkpoint or config.shard_dir):
+        # 检查点和分片中没有保存指纹, 不能与复制上次的日线同时使用
+        raise Exception("SQUANT_SKIP_UNCHANGED can not be used with SQUANT_CHECKPOINT or SQUANT_SHARD_DIR")
+    # 提前检查除权除息文件, 避免写完日线才发现配置错误
+    config.cqcx_list
+
+    tdx_reader, tdx_index, spools = None, None, None
+    if config.shard_dir:
+        # 日线和分钟线已经由 squant-ingest-shard 分片导入, 起止日期使用各分片记录的日线文件首末日期
+        spools = open_shards(config.shard_dir)
+        date_ranges = merge_date_ranges(spools)
+    else:
+        tdx_reader, tdx_index = open_tdx_reader(config, report)
+        date_ranges = tdx_date_ranges(tdx_index)
+
+    with report.stage('symbol_list'):
+        symbol_df, symbol_map = load_symbols(symbol_list, start_session, end_session, date_ranges)
+        report.add('symbol_list', rows=len(symbol_df))
+    if spools is not None:
+        check_shard_params(spools, shard_params(config, start_session, end_session, symbol_map))
 
-    tdx_reader = TdxReader(TDX_DIR)
+    # 写入基础信息
+    with report.stage('asset_db'):
+        asset_db_writer.write(symbol_df)
+        report.add('asset_db', rows=len(symbol_df))
+
+    fingerprints = None
+    if spools is not None:
+        # 按 sid 顺序合并各分片的日线和分钟线
+        hist_data = merge_shards(spools, 'daily')
+        minute_data = merge_shards(spools, 'minute')
+    else:
+        # 写入数据文件, 跳过没有日线文件和在导入区间内没有交易的代码
+        hist_symbol_map = filter_symbols(config, symbol_df, symbol_map, tdx_index, start_session, end_session)
+        previous = None
+        if config.skip_unchanged and output_dir:
+            previous_dir = find_previous_ingestion(output_dir)
+            previous = PreviousDailyBars(previous_dir) if previous_dir else None
+            fingerprints = DailyFingerprints.for_sessions(calendar.sessions_in_range(start_session, end_session))
+        hist_data = get_tdx_hist_data(config, symbol_df, hist_symbol_map, tdx_reader, start_session, end_session,
+                                      calendar, report, cache=cache, previous=previous, fingerprints=fingerprints)
+        if config.minute:
+            # 分钟线文件较大, 使用内存映射只复制日期范围内的记录
+            minute_reader = TdxReader(config.tdx_dir, mmap=True)
+            minute_data = get_minute_data(symbol_df, symbol_map, minute_reader, start_session, end_session,
+                                          calendar, freq=config.minute, report=report)
+
+    if config.compact:
+        hist_data = compact_to_ctables(hist_data)
+    # 日线的解析和写入交替进行, daily_source 为 writer 等待下一个代码的时间 (解析和对齐, 或等待子进程),
+    # daily_bars 减去 daily_source 为 writer 的时间; 每个代码的解析耗时见 report 的 symbols
+    with report.stage('daily_bars'):
+        daily_bar_writer.write(report.timed_iter('daily_source', hist_data), show_progress=show_progress)
+    if fingerprints is not None:
+        fingerprints.save(output_dir)
+    if config.minute:
+        with report.stage('minute_bars'):
+            minute_bar_writer.write(minute_data, show_progress=show_progress)
+    # split and diviends
+    with report.stage('cqcx'):
+        cqcx_data = load_cqcx_tables(config, cqcx_parser)
+        report.add('cqcx', rows=sum(len(data) for data in cqcx_data))
+        splits, dividends = zipline_splits_and_dividends(symbol_map, cqcx_data)
 
-    symbol_df = get_symbol_list()
-    # 只保留未停牌的
-    symbol_df = symbol_df[symbol_df['status'] == False]
+    # hack for tdx data , for tdx source for shenzhen market, we can not get data before 1991-12-23
+    splits_df= splits.loc[splits['effective_date'] > start_session]
+    dividends_df = dividends.loc[dividends['ex_date'] > start_session]
+    with report.stage('adjustments'):
+        adjustment_writer.write(
+            splits=splits_df,
+            dividends=dividends_df,
+        )
+        report.add('adjustments', rows=len(splits_df) + len(dividends_df))
+
+# 从环境变量读取配置的默认 bundle
+squant_bundle = make_squant_bundle()
+
+def load_symbols(symbol_list, start_session, end_session, date_ranges=None):
+    """
+    :param symbol_list: 返回代码列表的函数
+    :param date_ranges: tdx_date_ranges 的结果, 用于得到实际的首末交易日
+    :return: (symbol_df, symbol_map), symbol_df 为写入 asset_db 的基础信息, symbol_map 为 sid => 6 位代码
+    """
+    symbol_df = symbol_list()
 
     # 由于meta,split,dividend 和 行情数据源不同,所以有可能会不同,所以我们这里统一根据
 
     symbol_map = symbol_df.simplesymbol
+    symbol_df = build_asset_metadata(symbol_df, symbol_map, start_session, end_session, date_ranges)
+    return symbol_df, symbol_map
 
-    # 更新日期信息
-    def update_start_and_end_date(s):
-        start_date = start_session.replace(tzinfo=None)
-        end_date = end_session.replace(tzinfo=None)
-        if s.start_date < start_date:
-            s.start_date = start_date
-        if s.end_date == pd.Timestamp('1900-01-01') or s.end_date is pd.NaT:
-            s.end_date = end_date
-        return s
-    symbol_df = symbol_df.apply(func=update_start_and_end_date, axis=1)
-
+def tdx_date_ranges(tdx_index, keys=None):
+    """
+    :param tdx_index: TdxReader.build_index 的结果
+    :param keys: 只返回这些代码, 如 ['sh600000'], None 表示全部
+    :return: {'sh600000': (first_date, last_date)} 日线文件第一条和最后一条记录的日期
+    """
+    if keys is None:
+        keys = tdx_index.keys()
+    return dict((key, (tdx_index[key].first_date, tdx_index[key].last_date)) for key in keys if key in tdx_index)
 
-    # 写入基础信息
-    asset_db_writer.write(symbol_df)
-    # 写入数据文件
-    daily_bar_writer.write(get_hist_data(symbol_df, symbol_map, tdx_reader, start_session, end_session, calendar),
-                           show_progress=show_progress)
-    # split and diviends
-    splits, dividends = zipline_splits_and_dividends(symbol_map)
+def build_asset_metadata(symbol_df, symbol_map, start_session, end_session, date_ranges=None):
+    """
+    用数组运算生成 asset_db 的 start_date, end_date, 停牌的代码也会保留
 
-    # hack for tdx data , for tdx source for shenzhen market, we can not get data before 1991-12-23
-    splits_df = pd.concat(splits, ignore_index=True)
-    dividends_df = pd.concat(dividends, ignore_index=True)
-
-    splits_df= splits_df.loc[splits_df['effective_date'] > start_session]
-    dividends_df = dividends_df.loc[dividends_df['ex_date'] > start_session]
-    adjustment_writer.write(
-        splits=splits_df,
-        dividends=dividends_df,
-    )
-
-def get_hist_data(symbol_df, symbol_map, tdx_reader, start_session, end_session, calendar):
-    for sid, index in symbol_map.iteritems():
-        exchagne = ''
-        if symbol_df.loc[sid]['exchange'] == 'SZSE':
-            exchagne = 'sz'
-        elif symbol_df.loc[sid]['exchange'] == 'SSE':
-            exchagne = 'sh'
+    有通达信日线记录的代码使用第一条和最后一条记录的日期, 否则使用代码列表中的日期,
+    没有结束日期 (NaT 或 1900-01-01) 时为 end_session; 开始日期不早于 start_session, 结束日期不晚于 end_session,
+    在导入区间之前结束或之后开始的代码结束日期早于开始日期, 在导入区间内不存在 (也没有日线, 见 filter_by_tdx_index)
 
+    :param date_ranges: {'sh600000': (first_date, last_date)}, None 时只使用代码列表中的日期
+    """
+    start_date = np.datetime64(start_session.replace(tzinfo=None), 'ns')
+    end_date = np.datetime64(end_session.replace(tzinfo=None), 'ns')
+
+    starts = symbol_df['start_date'].values.astype('datetime64[ns]')
+    ends = symbol_df['end_date'].values.astype('datetime64[ns]')
+    ends = np.where(pd.isnull(ends) | (ends == np.datetime64('1900-01-01', 'ns')), end_date, ends)
+
+    if date_ranges is not None:
+        keys = tdx_exchanges(symbol_df, symbol_map) + symbol_map.values
+        first_dates = pd.Series(dict((key, first) for key, (first, _) in date_ranges.items()), dtype=np.int64)
+        last_dates = pd.Series(dict((key, last) for key, (_, last) in date_ranges.items()), dtype=np.int64)
+        first = first_dates.reindex(keys).values
+        last = last_dates.reindex(keys).values
+        # 空文件的首末日期为 0, 与没有日线文件一样使用代码列表中的日期
+        has_data = ~np.isnan(first) & (first != 0)
+        starts = np.where(has_data, int_to_datetime64(np.nan_to_num(first).astype(np.int64)), starts)
+        ends = np.where(has_data, int_to_datetime64(np.nan_to_num(last).astype(np.int64)), ends)
+
+    symbol_df = symbol_df.copy()
+    symbol_df['start_date'] = np.maximum(starts.astype('datetime64[ns]'), start_date)
+    symbol_df['end_date'] = np.minimum(ends.astype('datetime64[ns]'), end_date)
+    return symbol_df
+
+def open_tdx_reader(config, report):
+    """
+    :return: (tdx_reader, tdx_index)
+    """
+    with report.stage('tdx_index'):
+        tdx_reader = TdxReader(config.tdx_dir, store_path=config.tdx_store)
+        # 扫描一次日线目录, 之后不再逐个检查文件
+        tdx_index = tdx_reader.build_index()
+        report.add('tdx_index', rows=len(tdx_index), nbytes=sum(info.size for info in tdx_index.values()))
+    return tdx_reader, tdx_index
+
+def filter_symbols(config, symbol_df, symbol_map, tdx_index, start_session, end_session):
+    """
+    去掉没有日线, 导入区间内没有交易和被隔离的代码, 多进程模式下按 sid 排序
+    """
+    quarantine = load_quarantine(config.quarantine) if config.quarantine else None
+    hist_symbol_map = filter_by_tdx_index(symbol_df, symbol_map, tdx_index, start_session, end_session,
+                                          quarantine=quarantine)
+    if config.processes > 0:
+        # 多进程模式按 sid 顺序写入
+        hist_symbol_map = hist_symbol_map.sort_index()
+    return hist_symbol_map
+
+def get_tdx_hist_data(config, symbol_df, hist_symbol_map, tdx_reader, start_session, end_session, calendar,
+                      report, cache=None, previous=None, fingerprints=None):
+    """
+    根据配置在当前进程或进程池中解析日线, 设置了 checkpoint 时从 cache 中继续上次中断的导入
+    :param previous: PreviousDailyBars, 上次的导入, 只在 fingerprints 不为 None 时使用
+    :param fingerprints: DailyFingerprints, 不为 None 时复制上次导入中没有变化的日线, 并记录这次的指纹
+    """
+    checkpoint = None
+    if config.checkpoint and cache is not None:
+        checkpoint = IngestCheckpoint(cache, tdx_dir=config.tdx_dir, start_session=start_session,
+                                      end_session=end_session, compact=config.compact)
+        hist_order = hist_symbol_map.index
+        # 在解析前记录文件状态, 解析过程中文件有变化时, 下次导入会重新解析
+        sources = source_stats(symbol_df, hist_symbol_map, tdx_reader)
+        resumed = checkpoint.completed(sources)
+        hist_symbol_map = hist_symbol_map[~hist_symbol_map.index.isin(resumed)]
+        report.add('checkpoint', rows=len(hist_order) - len(hist_symbol_map))
+
+    if fingerprints is not None:
+        hist_data = get_hist_data_reusing(symbol_df, hist_symbol_map, tdx_reader, start_session, end_session,
+                                          calendar, previous, fingerprints, processes=config.processes,
+                                          max_inflight=config.max_inflight, report=report)
+    elif config.processes > 0:
+        hist_data = get_hist_data_parallel(symbol_df, hist_symbol_map, tdx_reader, start_session, end_session,
+                                           calendar, processes=config.processes, max_inflight=config.max_inflight,
+                                           compact=config.compact, report=report)
+    else:
+        hist_data = get_hist_data(symbol_df, hist_symbol_map, tdx_reader, start_session, end_session, calendar,
+                                  compact=config.compact, report=report)
+    if checkpoint is not None:
+        hist_data = checkpoint.resume(hist_order, hist_data, compact=config.compact, sources=sources)
+    return hist_data
+
+def source_stats(symbol_df, symbol_map, tdx_reader):
+    """
+    :return: {sid: (size, mtime)} 通达信日线文件的状态, 没有文件的代码不在其中
+    """
+    stats = {}
+    for (sid, index), exchange in zip(symbol_map.iteritems(), tdx_exchanges(symbol_df, symbol_map)):
         try:
-            history = tdx_reader.get_df(index, exchagne)
+            stats[sid] = file_stat(tdx_reader.get_filename(index, exchange))
+        except OSError:
+            continue
+    return stats
 
-            #print('max-min for %s is %s : %s', (index, history.index[0], history.index[-1]))
-            # 去除没有报价信息的内容
-            if history.index[0] > pd.Timestamp((end_session.date())):
-                continue
+def shard_params(config, start_session, end_session, symbol_map):
+    """
+    分片导入和合并时必须相同的参数, 代码列表相同才能保证各分片的 sid 一致
+    """
+    symbols = hashlib.sha1()
+    for sid, code in symbol_map.sort_index().iteritems():
+        symbols.update(('%d:%s,' % (sid, code)).encode('utf-8'))
+    return {
+        'start_session': str(start_session.date()),
+        'end_session': str(end_session.date()),
+        'compact': config.compact,
+        'minute': config.minute or '',
+        'symbols': symbols.hexdigest(),
+    }
+
+def shard_symbol_map(symbol_map, shard, num_shards):
+    """
+    按 sid 取模分片, 同一个代码列表在任何机器上的分片结果都相同
+    """
+    return symbol_map[symbol_map.index.values % num_shards == shard]
+
+def tdx_exchanges(symbol_df, symbol_map):
+    """
+    :return: 与 symbol_map 顺序相同的通达信交易所目录数组, 如 ['sh', 'sz', ...]
+    """
+    return symbol_df.loc[symbol_map.index, 'exchange'].map(EXCHANGE_TO_TDX).fillna('').values
+
+def filter_by_tdx_index(symbol_df, symbol_map, tdx_index, start_session, end_session, quarantine=None):
+    """
+    根据 TdxReader.build_index 的结果, 去掉没有日线文件, 导入区间开始前已经停止交易,
+    或者导入区间结束后才开始交易的代码, 不需要打开任何日线文件
+    :param quarantine: 需要跳过的代码集合, 如 {'sh600000'}
+    """
+    start, end = date_to_int(start_session), date_to_int(end_session)
+    keys = tdx_exchanges(symbol_df, symbol_map) + symbol_map.values
+    quarantine = quarantine or set()
+    infos = [None if key in quarantine else tdx_index.get(key) for key in keys]
+    keep = [info is not None and info.first_date <= end and info.last_date >= start for info in infos]
+    return symbol_map[keep]
+
+def add_seconds(timings, name, begin):
+    """
+    把 begin 到现在的秒数累加到 timings[name]
+    :param timings: dict, None 时不记录
+    :return: 现在的 time.perf_counter()
+    """
+    now = time.perf_counter()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + now - begin
+    return now
+
+def load_aligned_history(tdx_reader, aligner, index, exchange, compact=False, timings=None):
+    """
+    读取一个代码的日线并对齐到交易日
+    :param compact: 为 True 时返回 SessionAligner.align_compact 的 uint32 结构化数组
+    :param timings: dict, 不为 None 时累加读取通达信文件 (tdx_decode) 和对齐到交易日 (align) 的秒数
+    :return: DataFrame, 没有数据或者在导入区间结束后才开始交易时返回 None
+    """
+    begin = time.perf_counter()
+    try:
+        records = tdx_reader.get_records(index, exchange)
+    except TdxFileNotFoundException as e:
+        return None
+    begin = add_seconds(timings, 'tdx_decode', begin)
+
+    # 去除没有报价信息的内容
+    if len(records) == 0 or records['date'][0] > aligner.last_date:
+        return None
+    history = aligner.align_compact(records) if compact else aligner.align_records(records)
+    add_seconds(timings, 'align', begin)
+    return history
+
+def report_history(report, stage, sid, key, seconds, history, timings=None):
+    """
+    把一个代码的解析耗时和结果大小记录到 report 中
+    :param timings: load_aligned_history 等记录的各部分耗时, 累加到同名的环节中
+    """
+    if report is None:
+        return
+    report.add_symbol(sid, key, seconds)
+    for name, part in sorted((timings or {}).items()):
+        report.add_seconds(name, part)
+    if history is not None:
+        report.add(stage, rows=len(history), nbytes=bars_nbytes(history))
+
+def get_hist_data(symbol_df, symbol_map, tdx_reader, start_session, end_session, calendar, compact=False,
+                  report=None):
+    """
+    :param report: IngestReport, 记录每个代码的解析耗时, 以及 daily_bars 的行数和字节数
+    """
+    aligner = SessionAligner(calendar.sessions_in_range(start_session, end_session))
+    exchanges = tdx_exchanges(symbol_df, symbol_map)
+
+    for (sid, index), exchange in zip(symbol_map.iteritems(), exchanges):
+        begin = time.perf_counter()
+        timings = {}
+        history = load_aligned_history(tdx_reader, aligner, index, exchange, compact=compact, timings=timings)
+        report_history(report, 'daily_bars', sid, exchange + index, time.perf_counter() - begin, history, timings)
+        if history is not None:
+            yield sid, history
+
+# 子进程中的 TdxReader 和 SessionAligner, 由 _init_hist_worker 设置
+_hist_worker = {}
+
+def _init_hist_worker(tdx_reader, aligner, compact=False):
+    _hist_worker['tdx_reader'] = tdx_reader
+    _hist_worker['aligner'] = aligner
+    _hist_worker['compact'] = compact
+
+def _load_hist_worker(sid, index, exchange):
+    begin = time.perf_counter()
+    timings = {}
+    history = load_aligned_history(_hist_worker['tdx_reader'], _hist_worker['aligner'], index, exchange,
+                                   compact=_hist_worker['compact'], timings=timings)
+    return sid, history, time.perf_counter() - begin, timings
+
+def get_hist_data_parallel(symbol_df, symbol_map, tdx_reader, start_session, end_session, calendar,
+                           processes=None, max_inflight=None, compact=False, report=None):
+    """
+    与 get_hist_data 结果相同, 但在进程池中解析和对齐通达信日线, 按 sid 顺序返回给 writer
+    :param processes: 进程数, None 表示 cpu 个数
+    :param max_inflight: 最多同时在处理或等待写入的代码数
+    :param compact: 子进程返回 uint32 结构化数组, 传回主进程的数据量约为 DataFrame 的一半
+    :param report: IngestReport, 记录每个代码在子进程中的解析耗时, tdx_decode 和 align 为所有子进程的累计耗时
+    """
+    aligner = SessionAligner(calendar.sessions_in_range(start_session, end_session))
+    symbol_map = symbol_map.sort_index()
+
+    exchanges = tdx_exchanges(symbol_df, symbol_map)
+    keys = dict(zip(symbol_map.index, exchanges + symbol_map.values))
+    tasks = ((sid, index, exchange)
+             for (sid, index), exchange in zip(symbol_map.iteritems(), exchanges))
+
+    results = ordered_imap(_load_hist_worker, tasks, processes=processes, max_inflight=max_inflight,
+                           initializer=_init_hist_worker, initargs=(tdx_reader, aligner, compact))
+    for sid, history, seconds, timings in results:
+        report_history(report, 'daily_bars', sid, keys[sid], seconds, history, timings)
+        if history is not None:
+            yield sid, history
+
+def reusable_bars(previous, sid, aligner):
+    """
+    :param previous: PreviousDailyBars, 导入区间是这次的前缀
+    :return: 上次导入的日线, 交易日与这次的前面部分不同时 (交易日历有变化) 返回 None
+    """
+    bars = previous.get(sid)
+    if len(bars) > len(aligner) or not np.array_equal(bars['day'], aligner.session_seconds[:len(bars)]):
+        return None
+    return bars
+
+def extend_reused_bars(aligner, reused, records):
+    """
+    上次的日线放在前面, 只把上次导入之后的记录写入对应的交易日
+    """
+    bars = np.zeros(len(aligner), dtype=COMPACT_BAR_DTYPE)
+    bars['day'] = aligner.session_seconds
+    bars[:len(reused)] = reused
+    return aligner.fill_compact(bars, records)
+
+def load_reused_history(tdx_reader, aligner, previous, sid, index, exchange, timings=None):
+    """
+    与 load_aligned_history(compact=True) 结果相同, 但尽量复制上次导入的日线, 见 fingerprint
+    :param previous: PreviousDailyBars, 导入区间是这次的前缀, None 表示没有可以复用的导入
+    :param timings: 与 load_aligned_history 相同, 另外累加读取上次日线 (previous_bars) 的秒数
+    :return: (bars, entry, reused_rows), entry 为这次的指纹, 没有数据时 bars 和 entry 为 None
+    """
+    key = exchange + index
+    fname = tdx_reader.get_filename(index, exchange)
+    last = previous.fingerprints if previous is not None else None
+    entry = last.get(sid, key) if last is not None and sid in previous else None
+    try:
+        # 在读取前记录文件状态, 读取过程中文件有变化时, 下次导入会重新读取
+        stat = file_stat(fname)
+    except OSError:
+        return None, None, 0
+
+    begin = time.perf_counter()
+    reused = reusable_bars(previous, sid, aligner) if entry is not None else None
+    begin = add_seconds(timings, 'previous_bars', begin)
+    if reused is not None:
+        if last.end_date == aligner.last_date and stat == (entry['size'], entry['mtime']):
+            # 文件和导入区间都没有变化, 不需要读取
+            return reused, entry, len(reused)
+        appended = read_appended_records(fname, entry, stat)
+        begin = add_seconds(timings, 'tdx_decode', begin)
+        if appended is not None:
+            appended = appended[:np.searchsorted(appended['date'], aligner.last_date, side='right')]
+            bars = extend_reused_bars(aligner, reused, appended)
+            add_seconds(timings, 'align', begin)
+            return bars, appended_entry(entry, appended, stat), len(reused)
+
+    try:
+        records = tdx_reader.get_records(index, exchange)
+    except TdxFileNotFoundException as e:
+        return None, None, 0
+    begin = add_seconds(timings, 'tdx_decode', begin)
+    if len(records) == 0 or records['date'][0] > aligner.last_date:
+        return None, None, 0
+    records = records[:np.searchsorted(records['date'], aligner.last_date, side='right')]
+    new_entry = fingerprint_entry(key, records, stat)
+    begin = add_seconds(timings, 'fingerprint', begin)
+
+    if reused is not None and last.is_prefix(entry, records):
+        bars, reused_rows = extend_reused_bars(aligner, reused, records[entry['rows']:]), len(reused)
+    else:
+        bars, reused_rows = aligner.align_compact(records), 0
+    add_seconds(timings, 'align', begin)
+    return bars, new_entry, reused_rows
+
+def _timed_reused_history(tdx_reader, aligner, previous, sid, index, exchange):
+    begin = time.perf_counter()
+    timings = {}
+    bars, entry, reused_rows = load_reused_history(tdx_reader, aligner, previous, sid, index, exchange,
+                                                   timings=timings)
+    return sid, bars, entry, reused_rows, time.perf_counter() - begin, timings
+
+def _load_reused_worker(sid, index, exchange):
+    return _timed_reused_history(_hist_worker['tdx_reader'], _hist_worker['aligner'], _hist_worker['previous'],
+                                 sid, index, exchange)
+
+def _init_reused_worker(tdx_reader, aligner, previous):
+    _hist_worker['tdx_reader'] = tdx_reader
+    _hist_worker['aligner'] = aligner
+    _hist_worker['previous'] = previous
+
+def get_hist_data_reusing(symbol_df, symbol_map, tdx_reader, start_session, end_session, calendar, previous,
+                          fingerprints, processes=0, max_inflight=None, report=None):
+    """
+    与 get_hist_data(compact=True) 结果相同, 但没有变化的部分直接复制上次导入的日线, 见 fingerprint
+    :param previous: PreviousDailyBars, None 表示没有上次的导入
+    :param fingerprints: DailyFingerprints, 记录这次导入的指纹
+    :param processes: 大于 0 时在进程池中读取, 参数与 get_hist_data_parallel 相同
+    """
+    aligner = SessionAligner(calendar.sessions_in_range(start_session, end_session))
+    # 开始日期相同, 结束日期不早于上次时, 上次的日线是这次的前缀
+    if previous is not None and not previous.covers(aligner):
+        previous = None
+
+    if processes > 0:
+        symbol_map = symbol_map.sort_index()
+    exchanges = tdx_exchanges(symbol_df, symbol_map)
+    keys = dict(zip(symbol_map.index, exchanges + symbol_map.values))
+    tasks = ((sid, index, exchange)
+             for (sid, index), exchange in zip(symbol_map.iteritems(), exchanges))
+    if processes > 0:
+        results = ordered_imap(_load_reused_worker, tasks, processes=processes, max_inflight=max_inflight,
+                               initializer=_init_reused_worker, initargs=(tdx_reader, aligner, previous))
+    else:
+        results = (_timed_reused_history(tdx_reader, aligner, previous, *task) for task in tasks)
+
+    for sid, bars, entry, reused_rows, seconds, timings in results:
+        if entry is not None:
+            fingerprints.set_entry(sid, entry)
+        if report is not None and reused_rows:
+            report.add('reused_bars', rows=reused_rows)
+        report_history(report, 'daily_bars', sid, keys[sid], seconds, bars, timings)
+        if bars is not None:
+            yield sid, bars
+
+def compact_to_ctables(hist_data):
+    """
+    把 compact 模式的结构化数组转换为 bcolz ctable, BcolzDailyBarWriter 收到 ctable 时直接写入,
+    不再经过 DataFrame * 1000 和 astype('uint32')
+    """
+    from bcolz import ctable
+
+    for sid, bars in hist_data:
+        yield sid, ctable(bars)
+
+def get_minute_data(symbol_df, symbol_map, tdx_reader, start_session, end_session, calendar, freq='1m',
+                    report=None):
+    """
+    逐个代码读取通达信分钟线, 只保留交易日历中的分钟, 每次只在内存中保留一个代码的数据
+    :param report: IngestReport, 记录 minute_bars 的行数和字节数
+    """
+    minutes = calendar.minutes_for_sessions_in_range(start_session, end_session)
+
+    for (sid, index), exchagne in zip(symbol_map.iteritems(), tdx_exchanges(symbol_df, symbol_map)):
+        try:
+            records = tdx_reader.get_minute_records(index, exchagne, freq, start_session.date(), end_session.date())
         except TdxFileNotFoundException as e:
-            #print('symbol %s file no found, ignore it ' % index)
             continue
-        # history.to_pickle('/tmp/debug.pickle')
-
-        #reindex
-        sessions = calendar.sessions_in_range(start_session, end_session)
+        if len(records) == 0:
+            continue
 
-        history = history.reindex(
-            sessions.tz_localize(None),
-            copy=False,
-        ).fillna(0.0)
+        history = minute_records_to_df(records)
+        # 去除不在交易时间内的分钟
+        history = history[minutes.get_indexer(history.index) >= 0]
+        if len(history) == 0:
+            continue
 
-        yield sid, history.sort_index()
-    pass
+        if report is not None:
+            report.add('minute_bars', rows=len(history), nbytes=bars_nbytes(history))
+        yield sid, history
 
 if __name__ == '__main__':
 
@@ -204,22 +716,7 @@ if __name__ == '__main__':
     df_symbols = pd.DataFrame(data=symbols).sort_values('symbol')
     symbol_map = pd.DataFrame.copy(df_symbols.symbol)
 
-    raw_splits, raw_dividends = load_splits_and_dividends()
-
-    splits = []
-    dividends = []
-    for sid, code in symbol_map.iteritems():
-        if code in raw_splits:
-            split = pd.DataFrame(data=raw_splits[code])
-            split['sid'] = sid
-            split.index = split['effective_date'] = pd.DatetimeIndex(split['effective_date'])
-            splits.append(split)
-        if code in raw_dividends:
-            dividend = pd.DataFrame(data = raw_dividends[code])
-            dividend['sid'] = sid
-            dividend['record_date'] = dividend['declared_date'] = dividend['pay_date'] = pd.NaT
-            dividend.index = dividend['ex_date'] = pd.DatetimeIndex(dividend['ex_date'])
-            dividends.append(dividend)
-
-    print(pd.concat(splits, ignore_index=True))
-    print(pd.concat(dividends, ignore_index=True))
+    splits, dividends = zipline_splits_and_dividends(symbol_map)
+
+    print(splits)
+    print(dividends)
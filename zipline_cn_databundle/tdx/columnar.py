@@ -0,0 +1,175 @@
+import glob
+import os
+import shutil
+
+import click
+import numpy as np
+
+from .reader import TDX_DAY_DTYPE, date_range_positions
+from .incremental import TdxManifest, UNCHANGED, APPENDED
+
+"""
+把整个 vipdoc 目录下沪深两市的日线合并为一个列式存储
+
+    store/
+        date.npy, open.npy, ..., volume.npy  每列一个连续数组
+        index.json                           每个代码在数组中的 [start, stop) 和源文件状态
+
+读取时以内存映射方式打开, 不需要再逐个打开几千个小文件, 适合放在 NFS 上共享
+"""
+
+TDX_STORE_FIELDS = tuple(name for name in TDX_DAY_DTYPE.names if name != 'reserved')
+
+
+def list_day_files(vipdoc_path, exchanges=('sh', 'sz')):
+    """
+    :return: {'sh600000': 文件路径, ...}
+    """
+    files = {}
+    for exchange in exchanges:
+        pattern = os.path.join(vipdoc_path, exchange, 'lday', '%s*.day' % exchange)
+        for fname in glob.glob(pattern):
+            files[os.path.basename(fname)[:-len('.day')]] = fname
+    return files
+
+
+class TdxColumnarStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.index = TdxManifest(os.path.join(path, 'index.json'))
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = {
+                field: np.load(os.path.join(self.path, '%s.npy' % field), mmap_mode='r')
+                for field in TDX_STORE_FIELDS
+            }
+        return self._columns
+
+    def __contains__(self, key):
+        return key in self.index.entries
+
+    def keys(self):
+        return sorted(self.index.entries)
+
+    def get_positions(self, key, start=None, end=None):
+        """
+        :return: key 在 [start, end] 区间内的记录在各列数组中的位置 (begin, stop)
+        """
+        entry = self.index.entries[key]
+        begin, stop = entry['start'], entry['stop']
+        if start is not None or end is not None:
+            lo, hi = date_range_positions(self.columns['date'][begin:stop], start, end)
+            begin, stop = begin + lo, begin + hi
+        return begin, stop
+
+    def get_records(self, key, start=None, end=None):
+        """
+        :return: TDX_DAY_DTYPE 结构化数组, 只复制 [start, end] 内的记录
+        """
+        begin, stop = self.get_positions(key, start, end)
+        records = np.zeros(stop - begin, dtype=TDX_DAY_DTYPE)
+        for field in TDX_STORE_FIELDS:
+            records[field] = self.columns[field][begin:stop]
+        return records
+
+
+def build_columnar_store(vipdoc_path, store_path, exchanges=('sh', 'sz'), show_progress=False):
+    """
+    生成或更新列式存储
+
+    已有的存储中, 源文件没有变化的代码直接复制, 有追加的只读取新增的记录,
+    新的存储先写到临时目录, 完成后再替换旧的存储
+    :return: {状态: 代码个数}
+    """
+    files = list_day_files(vipdoc_path, exchanges)
+    keys = sorted(files)
+    # 记录数由文件大小决定, 先分配好每一列
+    counts = [os.path.getsize(files[key]) // TDX_DAY_DTYPE.itemsize for key in keys]
+    total = sum(counts)
+
+    old_store = None
+    if os.path.isfile(os.path.join(store_path, 'index.json')):
+        old_store = TdxColumnarStore(store_path)
+
+    tmp_path = store_path.rstrip(os.sep) + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    columns = {}
+    for field in TDX_STORE_FIELDS:
+        fname = os.path.join(tmp_path, '%s.npy' % field)
+        if total == 0:
+            np.save(fname, np.empty(0, dtype=TDX_DAY_DTYPE[field]))
+            continue
+        columns[field] = np.lib.format.open_memmap(fname, mode='w+', dtype=TDX_DAY_DTYPE[field], shape=(total,))
+
+    index = TdxManifest(os.path.join(tmp_path, 'index.json'))
+    stats = dict.fromkeys(('unchanged', 'appended', 'changed'), 0)
+    position = 0
+    for i, (key, count) in enumerate(zip(keys, counts)):
+        fname = files[key]
+        status, offset = 'changed', 0
+        if old_store is not None and key in old_store:
+            status, offset = old_store.index.check(key, fname)
+
+        if status == UNCHANGED:
+            records = old_store.get_records(key)
+        elif status == APPENDED:
+            with open(fname, 'rb') as f:
+                f.seek(offset)
+                appended = np.fromfile(f, dtype=TDX_DAY_DTYPE)
+            records = np.concatenate([old_store.get_records(key), appended])
+        else:
+            records = np.fromfile(fname, dtype=TDX_DAY_DTYPE)
+        stats[status] += 1
+
+        # 统计大小之后文件又有追加的, 留到下次更新
+        records = records[:count]
+        stop = position + len(records)
+        for field in columns:
+            columns[field][position:stop] = records[field]
+
+        entry = index.make_entry(fname, records)
+        entry['start'], entry['stop'] = position, stop
+        index.entries[key] = entry
+        position = stop
+
+        if show_progress and (i + 1) % 500 == 0:
+            click.echo('packed %d/%d' % (i + 1, len(keys)))
+
+    for column in columns.values():
+        column.flush()
+    columns.clear()
+    index.save()
+
+    # 替换旧的存储
+    if os.path.isdir(store_path):
+        old_path = store_path.rstrip(os.sep) + '.old'
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        os.rename(store_path, old_path)
+        os.rename(tmp_path, store_path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, store_path)
+    return stats
+
+
+@click.command()
+@click.argument("vipdoc")
+@click.argument("store")
+def build_store(vipdoc, store):
+    """
+    pack all tdx day files under VIPDOC into a columnar STORE
+    """
+    stats = build_columnar_store(vipdoc, store, show_progress=True)
+    click.echo("done! unchanged: %(unchanged)d, appended: %(appended)d, changed: %(changed)d" % stats)
+
+
+if __name__ == "__main__":
+    build_store()
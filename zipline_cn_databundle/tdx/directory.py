@@ -0,0 +1,48 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from .reader import TDX_DAY_DTYPE
+
+"""
+扫描 vipdoc/{sh,sz}/lday 目录, 建立代码到日线文件的索引
+
+每个文件只读取第一条和最后一条记录, 用来得到起止日期
+"""
+
+TdxFileInfo = namedtuple('TdxFileInfo', ['fname', 'size', 'mtime', 'first_date', 'last_date'])
+
+
+def read_date_range(fname, size):
+    """
+    读取日线文件第一条和最后一条记录的日期
+    :return: (first_date, last_date), 空文件返回 (0, 0)
+    """
+    count = size // TDX_DAY_DTYPE.itemsize
+    if count == 0:
+        return 0, 0
+    with open(fname, 'rb') as f:
+        first = np.fromfile(f, dtype=TDX_DAY_DTYPE, count=1)
+        f.seek((count - 1) * TDX_DAY_DTYPE.itemsize)
+        last = np.fromfile(f, dtype=TDX_DAY_DTYPE, count=1)
+    return int(first['date'][0]), int(last['date'][0])
+
+
+def scan_lday(vipdoc_path, exchanges=('sh', 'sz')):
+    """
+    :return: {'sh600000': TdxFileInfo, ...}
+    """
+    index = {}
+    for exchange in exchanges:
+        lday_path = os.path.join(vipdoc_path, exchange, 'lday')
+        if not os.path.isdir(lday_path):
+            continue
+        for entry in os.scandir(lday_path):
+            name = entry.name
+            if not (name.startswith(exchange) and name.endswith('.day')):
+                continue
+            st = entry.stat()
+            first_date, last_date = read_date_range(entry.path, st.st_size)
+            index[name[:-len('.day')]] = TdxFileInfo(entry.path, st.st_size, st.st_mtime, first_date, last_date)
+    return index
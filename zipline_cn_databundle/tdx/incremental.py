@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+
+from .reader import TDX_DAY_DTYPE
+
+"""
+记录通达信日线文件的状态, 判断文件是否有变化
+
+通达信的 .day 文件只会在末尾追加记录, 所以记录每个文件上次读取时的
+大小, 修改时间, 最后日期和读取位置, 下次读取时 (见 columnar.build_columnar_store):
+
+    * 文件没有变化, 直接使用上次保存的记录
+    * 文件有追加, 只从上次的位置开始读取新的记录, 与上次的记录合并
+    * 其他情况(文件被重写或截断), 重新读取整个文件
+"""
+
+UNCHANGED = 'unchanged'
+APPENDED = 'appended'
+CHANGED = 'changed'
+
+
+def file_stat(fname):
+    st = os.stat(fname)
+    return st.st_size, st.st_mtime
+
+
+class TdxManifest(object):
+    """
+    每个日线文件上次导入的状态, 以 json 保存
+    {'sh600000': {'fname':, 'size':, 'mtime':, 'offset':, 'last_date':}, ...}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def check(self, key, fname):
+        """
+        :return: (状态, 上次读取到的字节位置)
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['fname'] != fname:
+            return CHANGED, 0
+
+        size, mtime = file_stat(fname)
+        offset = entry['offset']
+        if self.is_current(key, size, mtime):
+            return UNCHANGED, offset
+
+        if size > offset >= TDX_DAY_DTYPE.itemsize:
+            # 上次的最后一条记录没有变化才认为是追加
+            with open(fname, 'rb') as f:
+                f.seek(offset - TDX_DAY_DTYPE.itemsize)
+                last = np.fromfile(f, dtype=TDX_DAY_DTYPE, count=1)
+            if len(last) == 1 and last['date'][0] == entry['last_date']:
+                return APPENDED, offset
+
+        return CHANGED, 0
+
+    def is_current(self, key, size, mtime):
+        """
+        :return: 文件大小和修改时间与上次相同, 并且上次读取了整个文件
+        """
+        entry = self.entries.get(key)
+        return entry is not None and size == entry['size'] == entry['offset'] and mtime == entry['mtime']
+
+    def make_entry(self, fname, records):
+        size, mtime = file_stat(fname)
+        return {
+            'fname': fname,
+            'size': size,
+            'mtime': mtime,
+            'offset': len(records) * TDX_DAY_DTYPE.itemsize,
+            'last_date': int(records['date'][-1]) if len(records) else 0,
+        }
+
+    def save(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
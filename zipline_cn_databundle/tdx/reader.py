@@ -7,20 +7,223 @@ import struct
 读取通达信数据
 """
 
+# 通达信日线记录格式, 每条记录32字节
+# 日期(YYYYMMDD), 开, 高, 低, 收 (单位: 分), 成交额, 成交量, 保留
+TDX_DAY_FORMAT = '<iiiiifii'
+
+TDX_DAY_DTYPE = np.dtype([
+    ('date', '<i4'),
+    ('open', '<i4'),
+    ('high', '<i4'),
+    ('low', '<i4'),
+    ('close', '<i4'),
+    ('amount', '<f4'),
+    ('volume', '<i4'),
+    ('reserved', '<i4'),
+])
+
+TDX_PRICE_FIELDS = ('open', 'high', 'low', 'close')
+
+# 通达信分钟线记录格式 (minline/*.lc1, fzline/*.lc5), 每条记录32字节
+# 日期(压缩), 分钟(从0点开始), 开, 高, 低, 收 (单位: 元), 成交额, 成交量, 保留
+TDX_MINUTE_DTYPE = np.dtype([
+    ('date', '<u2'),
+    ('minute', '<u2'),
+    ('open', '<f4'),
+    ('high', '<f4'),
+    ('low', '<f4'),
+    ('close', '<f4'),
+    ('amount', '<f4'),
+    ('volume', '<i4'),
+    ('reserved', '<i4'),
+])
+
+# 频率 => (目录, 扩展名)
+TDX_MINUTE_FILES = {
+    '1m': ('minline', 'lc1'),
+    '5m': ('fzline', 'lc5'),
+}
+
+TDX_TIMEZONE = 'Asia/Shanghai'
+
+
+def int_to_datetime64(dates):
+    """
+    把 YYYYMMDD 格式的整数数组转换为 datetime64[D], 全部使用数组运算
+    :param dates: 整数数组
+    :return: datetime64[D] 数组
+    """
+    dates = np.asarray(dates, dtype=np.int64)
+    years = (dates // 10000 - 1970).astype('datetime64[Y]')
+    months = (dates // 100 % 100 - 1).astype('timedelta64[M]')
+    days = (dates % 100 - 1).astype('timedelta64[D]')
+    return (years + months).astype('datetime64[D]') + days
+
+
+def date_to_int(dt):
+    """
+    把日期转换为 YYYYMMDD 格式的整数
+    """
+    dt = pd.Timestamp(dt)
+    return dt.year * 10000 + dt.month * 100 + dt.day
+
+
+def dates_to_int(dates):
+    """
+    把 DatetimeIndex 转换为 YYYYMMDD 格式的整数数组
+    """
+    dates = pd.DatetimeIndex(dates)
+    return np.asarray(dates.year * 10000 + dates.month * 100 + dates.day, dtype=np.int64)
+
+
+def date_range_positions(dates, start=None, end=None):
+    """
+    在按日期排序的 YYYYMMDD 数组中二分查找 [start, end] 区间
+    :return: (lo, hi) 区间为 dates[lo:hi]
+    """
+    lo, hi = 0, len(dates)
+    if start is not None:
+        lo = np.searchsorted(dates, date_to_int(start), side='left')
+    if end is not None:
+        hi = np.searchsorted(dates, date_to_int(end), side='right')
+    return lo, hi
+
+
+def slice_records(records, start=None, end=None):
+    """
+    在按日期排序的记录中二分查找 [start, end] 区间, 返回切片视图 (不复制)
+    """
+    if start is None and end is None:
+        return records
+    lo, hi = date_range_positions(records['date'], start, end)
+    return records[lo:hi]
+
+
+def minute_date_to_int(dt):
+    """
+    把日期转换为分钟线记录中的压缩日期: (年 - 2004) * 2048 + 月 * 100 + 日
+    """
+    dt = pd.Timestamp(dt)
+    return (dt.year - 2004) * 2048 + dt.month * 100 + dt.day
+
+
+def minute_records_to_datetime64(records):
+    """
+    把分钟线记录的压缩日期和分钟数转换为本地时间的 datetime64[m]
+    """
+    dates = records['date'].astype(np.int64)
+    days = int_to_datetime64(
+        (dates // 2048 + 2004) * 10000 + dates % 2048
+    )
+    return days.astype('datetime64[m]') + records['minute'].astype('timedelta64[m]')
+
+
+def slice_minute_records(records, start=None, end=None):
+    """
+    与 slice_records 相同, 但使用分钟线的压缩日期
+    """
+    lo, hi = 0, len(records)
+    if start is not None:
+        lo = np.searchsorted(records['date'], minute_date_to_int(start), side='left')
+    if end is not None:
+        hi = np.searchsorted(records['date'], minute_date_to_int(end), side='right')
+    return records[lo:hi]
+
+
+def minute_records_to_df(records):
+    """
+    把分钟线结构化数组转换为 DataFrame, 索引为 UTC 时间, 与 zipline minute bar 一致
+    """
+    index = pd.DatetimeIndex(
+        minute_records_to_datetime64(records).astype('datetime64[ns]'),
+    ).tz_localize(TDX_TIMEZONE).tz_convert('UTC')
+    data = {}
+    for field in TDX_PRICE_FIELDS:
+        # 价格以 float32 存储, 还原到分
+        data[field] = np.round(records[field].astype(np.float64), 2)
+    data['volume'] = records['volume'].astype(np.int64)
+    return pd.DataFrame(data=data, index=index, columns=TDX_PRICE_FIELDS + ('volume',))
+
+
+def records_to_df(records):
+    """
+    把通达信日线的结构化数组转换为 get_df 的 DataFrame 格式
+    """
+    index = pd.DatetimeIndex(
+        int_to_datetime64(records['date']).astype('datetime64[ns]'),
+        name='date',
+    )
+    data = {}
+    for field in TDX_PRICE_FIELDS:
+        # * 0.01 * 1000 , zipline need 1000 times to original price
+        data[field] = records[field] * 0.01
+    data['volume'] = records['volume'].astype(np.int64)
+    return pd.DataFrame(data=data, index=index, columns=TDX_PRICE_FIELDS + ('volume',))
+
 
 class TdxFileNotFoundException(Exception):
     pass
 
 class TdxReader:
 
-    def __init__(self, vipdoc_path):
+    def __init__(self, vipdoc_path, mmap=False, store_path=None):
+        """
+        :param vipdoc_path: 通达信 vipdoc 目录
+        :param mmap: 使用内存映射方式读取日线文件, 按日期取数时只复制需要的记录
+        :param store_path: build_columnar_store 生成的列式存储, 源文件的大小和修改时间与存储中记录的相同时
+                           从存储读取, 否则读取源文件; 更新通达信数据后需要重新生成存储才能从存储读取
+        """
         self.vipdoc_path = vipdoc_path
+        self.mmap = mmap
+        self.store_path = store_path
+        self._store = None
+        # build_index 生成的 {'sh600000': TdxFileInfo}
+        self.index = None
 
-    def get_kline_by_code(self, code, exchange):
+    def __getstate__(self):
+        # 传给子进程时不复制已经打开的内存映射
+        state = self.__dict__.copy()
+        state['_store'] = None
+        return state
+
+    @property
+    def store(self):
+        if self._store is None and self.store_path:
+            from .columnar import TdxColumnarStore
+            self._store = TdxColumnarStore(self.store_path)
+        return self._store
+
+    def build_index(self):
+        """
+        扫描一次 lday 目录, 之后按代码读取时不再逐个检查文件是否存在
+        :return: {'sh600000': TdxFileInfo}
+        """
+        from .directory import scan_lday
+        self.index = scan_lday(self.vipdoc_path)
+        return self.index
+
+    def get_file_info(self, code, exchange):
+        """
+        :return: TdxFileInfo, 需要先调用 build_index, 没有数据时返回 None
+        """
+        return self.index.get('%s%s' % (exchange, code))
+
+    def get_filename(self, code, exchange):
         fname = os.path.join(self.vipdoc_path, exchange)
         fname = os.path.join(fname, 'lday')
-        fname = os.path.join(fname, '%s%s.day' % (exchange, code))
-        return self.parse_data_by_file(fname)
+        return os.path.join(fname, '%s%s.day' % (exchange, code))
+
+    def get_kline_by_code(self, code, exchange):
+        return self.parse_data_by_file(self.get_filename(code, exchange))
+
+    def _read_day_file(self, code, exchange):
+        if self.index is None:
+            return self.parse_records_by_file(self.get_filename(code, exchange))
+
+        info = self.get_file_info(code, exchange)
+        if info is None:
+            raise TdxFileNotFoundException('no tdx kline data for %s%s in index', exchange, code)
+        return np.fromfile(info.fname, dtype=TDX_DAY_DTYPE)
 
     def parse_data_by_file(self, fname):
 
@@ -29,7 +232,7 @@ class TdxReader:
 
         with open(fname, 'rb') as f:
             content = f.read()
-            return self.unpack_records('<iiiiifii', content)
+            return self.unpack_records(TDX_DAY_FORMAT, content)
         return []
 
     def unpack_records(self, format, data):
@@ -37,7 +240,133 @@ class TdxReader:
         return (record_struct.unpack_from(data, offset)
                 for offset in range(0, len(data), record_struct.size))
 
-    def get_df(self, code, exchange):
+    def get_records(self, code, exchange, start=None, end=None):
+        """
+        读取日线文件为 TDX_DAY_DTYPE 的结构化数组, 不逐行解析
+        :param start: 起始日期(含), None 表示不限制
+        :param end: 结束日期(含), None 表示不限制
+        """
+        key = '%s%s' % (exchange, code)
+        if self.store is not None and self._store_is_current(key, code, exchange):
+            return self.store.get_records(key, start, end)
+
+        if self.mmap:
+            # 只复制 [start, end] 区间内的记录, 其余部分不会读入内存
+            return np.array(slice_records(self.get_view(code, exchange), start, end))
+
+        return slice_records(self._read_day_file(code, exchange), start, end)
+
+    def _store_is_current(self, key, code, exchange):
+        """
+        源文件在生成存储之后没有变化; 有 build_index 的结果时使用其中的大小和修改时间, 不再 stat
+        """
+        if self.index is not None:
+            info = self.index.get(key)
+            if info is None:
+                return False
+            size, mtime = info.size, info.mtime
+        else:
+            fname = self.get_filename(code, exchange)
+            if not os.path.isfile(fname):
+                return False
+            st = os.stat(fname)
+            size, mtime = st.st_size, st.st_mtime
+        return self.store.index.is_current(key, size, mtime)
+
+    def get_view(self, code, exchange):
+        """
+        以只读内存映射方式打开日线文件, 返回结构化数组视图
+        多个进程读取同一个 vipdoc 目录时共享操作系统的页缓存
+        """
+        return self.map_records_by_file(self.get_filename(code, exchange))
+
+    def parse_records_by_file(self, fname):
+        if not os.path.isfile(fname):
+            raise TdxFileNotFoundException('no tdx kline data, pleaes check path %s', fname)
+
+        return np.fromfile(fname, dtype=TDX_DAY_DTYPE)
+
+    def map_records_by_file(self, fname):
+        if not os.path.isfile(fname):
+            raise TdxFileNotFoundException('no tdx kline data, pleaes check path %s', fname)
+
+        count = os.path.getsize(fname) // TDX_DAY_DTYPE.itemsize
+        if count == 0:
+            # 空文件无法映射
+            return np.empty(0, dtype=TDX_DAY_DTYPE)
+        return np.memmap(fname, dtype=TDX_DAY_DTYPE, mode='r', shape=(count,))
+
+    def get_df(self, code, exchange, start=None, end=None):
+        return records_to_df(self.get_records(code, exchange, start, end))
+
+    def get_minute_filename(self, code, exchange, freq='1m'):
+        if freq not in TDX_MINUTE_FILES:
+            raise ValueError('unsupported tdx minute frequency %s' % freq)
+        dirname, ext = TDX_MINUTE_FILES[freq]
+        fname = os.path.join(self.vipdoc_path, exchange, dirname)
+        return os.path.join(fname, '%s%s.%s' % (exchange, code, ext))
+
+    def get_minute_records(self, code, exchange, freq='1m', start=None, end=None):
+        """
+        读取分钟线文件为 TDX_MINUTE_DTYPE 的结构化数组
+        :param freq: '1m' 读取 minline/*.lc1, '5m' 读取 fzline/*.lc5
+        """
+        fname = self.get_minute_filename(code, exchange, freq)
+        if not os.path.isfile(fname):
+            raise TdxFileNotFoundException('no tdx minute data, pleaes check path %s', fname)
+
+        if self.mmap:
+            count = os.path.getsize(fname) // TDX_MINUTE_DTYPE.itemsize
+            if count == 0:
+                return np.empty(0, dtype=TDX_MINUTE_DTYPE)
+            view = np.memmap(fname, dtype=TDX_MINUTE_DTYPE, mode='r', shape=(count,))
+            return np.array(slice_minute_records(view, start, end))
+
+        records = np.fromfile(fname, dtype=TDX_MINUTE_DTYPE)
+        return slice_minute_records(records, start, end)
+
+    def get_minute_df(self, code, exchange, freq='1m', start=None, end=None):
+        return minute_records_to_df(self.get_minute_records(code, exchange, freq, start, end))
+
+    def get_panel(self, codes, sessions, fields=TDX_PRICE_FIELDS + ('volume',)):
+        """
+        批量读取多个代码, 按 sessions 对齐为三维数组, 不生成任何 DataFrame
+
+        :param codes: 代码列表, 格式与文件名相同, 如 ['sh600000', 'sz000001']
+        :param sessions: 交易日 DatetimeIndex
+        :param fields: 字段, 价格单位为元
+        :return: float64 数组, 形状为 (len(fields), len(sessions), len(codes)),
+                 没有数据的位置为 nan
+        """
+        session_dates = dates_to_int(sessions)
+        panel = np.full((len(fields), len(session_dates), len(codes)), np.nan)
+        if len(session_dates) == 0:
+            return panel
+
+        start, end = sessions[0], sessions[-1]
+        for i, key in enumerate(codes):
+            try:
+                records = self.get_records(key[2:], key[:2], start, end)
+            except TdxFileNotFoundException:
+                continue
+
+            positions = np.searchsorted(session_dates, records['date'])
+            # 丢弃不在 sessions 中的日期
+            valid = positions < len(session_dates)
+            valid[valid] = session_dates[positions[valid]] == records['date'][valid]
+            positions = positions[valid]
+
+            for j, field in enumerate(fields):
+                values = records[field][valid]
+                if field in TDX_PRICE_FIELDS:
+                    values = values * 0.01
+                panel[j, positions, i] = values
+        return panel
+
+    def get_df_by_rows(self, code, exchange):
+        """
+        逐行解析的旧实现, 结果与 get_df 相同, 保留用于校验和性能对比
+        """
         data = [self._df_convert(row) for row in self.get_kline_by_code(code, exchange)]
         df =  pd.DataFrame(data=data, columns=('date', 'open', 'high', 'low', 'close', 'amount', 'volume'))
         df.index = pd.to_datetime(df.date)
@@ -0,0 +1,126 @@
+import os
+
+import click
+import numpy as np
+import pandas as pd
+
+from .reader import TDX_DAY_DTYPE, TDX_PRICE_FIELDS
+from .columnar import list_day_files
+from ..parallel import ordered_imap
+
+"""
+导入前检查通达信日线数据
+
+每个文件用数组运算检查, 多个文件在进程池中并行检查, 生成每个代码的报告和隔离列表,
+squant_bundle 通过 TDX_QUARANTINE 环境变量读取隔离列表, 跳过其中的代码
+"""
+
+# 出现以下问题的文件会被加入隔离列表
+QUARANTINE_ISSUES = (
+    'truncated',
+    'invalid_date',
+    'non_monotonic_date',
+    'duplicate_date',
+    'non_positive_price',
+    'high_below_low',
+    'negative_volume',
+)
+
+REPORT_COLUMNS = ('fname', 'size', 'rows', 'first_date', 'last_date') + QUARANTINE_ISSUES
+
+
+def validate_records(records, size):
+    """
+    :param records: TDX_DAY_DTYPE 结构化数组
+    :param size: 文件大小
+    :return: {问题: 出现次数}
+    """
+    dates = records['date']
+    months = dates // 100 % 100
+    days = dates % 100
+    diffs = np.diff(dates)
+
+    issues = {
+        'truncated': int(size % TDX_DAY_DTYPE.itemsize != 0),
+        'invalid_date': int(np.count_nonzero(
+            (dates < 19900101) | (months < 1) | (months > 12) | (days < 1) | (days > 31)
+        )),
+        'non_monotonic_date': int(np.count_nonzero(diffs < 0)),
+        'duplicate_date': int(np.count_nonzero(diffs == 0)),
+        'non_positive_price': int(sum(np.count_nonzero(records[field] <= 0) for field in TDX_PRICE_FIELDS)),
+        'high_below_low': int(np.count_nonzero(records['high'] < records['low'])),
+        'negative_volume': int(np.count_nonzero(records['volume'] < 0)),
+    }
+    return issues
+
+
+def validate_file(fname):
+    """
+    :return: 一行报告, 格式与 REPORT_COLUMNS 相同
+    """
+    size = os.path.getsize(fname)
+    records = np.fromfile(fname, dtype=TDX_DAY_DTYPE, count=size // TDX_DAY_DTYPE.itemsize)
+    issues = validate_records(records, size)
+    first_date = int(records['date'][0]) if len(records) else 0
+    last_date = int(records['date'][-1]) if len(records) else 0
+    return (fname, size, len(records), first_date, last_date) + tuple(issues[k] for k in QUARANTINE_ISSUES)
+
+
+def scan_vipdoc(vipdoc_path, exchanges=('sh', 'sz'), processes=None):
+    """
+    检查整个 vipdoc 目录
+    :return: 以代码为索引的 DataFrame, 列为 REPORT_COLUMNS
+    """
+    files = list_day_files(vipdoc_path, exchanges)
+    keys = sorted(files)
+    rows = list(ordered_imap(validate_file, ((files[key],) for key in keys), processes=processes))
+    report = pd.DataFrame(data=rows, index=pd.Index(keys, name='code'), columns=REPORT_COLUMNS)
+    return report
+
+
+def quarantine_codes(report):
+    """
+    :return: 有问题的代码列表
+    """
+    bad = (report[list(QUARANTINE_ISSUES)] > 0).any(axis=1)
+    return list(report.index[bad])
+
+
+def save_quarantine(codes, path):
+    with open(path, 'w') as f:
+        f.write("\n".join(codes))
+
+
+def load_quarantine(path):
+    """
+    :return: 隔离列表中的代码集合, 如 {'sh600000'}
+    """
+    with open(path, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+@click.command()
+@click.argument("vipdoc")
+@click.option("--report", default=None, help="write the per-symbol report to this csv file")
+@click.option("--quarantine", default=None, help="write bad codes to this file, used by TDX_QUARANTINE")
+@click.option("--processes", default=None, type=int, help="number of worker processes")
+def validate(vipdoc, report, quarantine, processes):
+    """
+    check all tdx day files under VIPDOC before ingestion
+    """
+    result = scan_vipdoc(vipdoc, processes=processes)
+    bad = quarantine_codes(result)
+
+    if report:
+        result.to_csv(report)
+    if quarantine:
+        save_quarantine(bad, quarantine)
+
+    click.echo("checked %d files, %d rows, %d bad" % (len(result), result['rows'].sum(), len(bad)))
+    for code in bad:
+        issues = result.loc[code, list(QUARANTINE_ISSUES)]
+        click.echo("%s: %s" % (code, ", ".join("%s=%d" % (k, v) for k, v in issues.iteritems() if v)))
+
+
+if __name__ == "__main__":
+    validate()
@@ -1,8 +1,10 @@
 import click
-import tushare as ts
+import numpy as np
 import pandas as pd
 import os
 from .squant_source import load_splits_and_dividends, zipline_splits_and_dividends
+from .fetcher import HistoryFetcher
+from .align import SessionAligner
 
 """
 从tushare获取股票信息
@@ -26,6 +28,10 @@ if not ZIPLINE_TL_TOKEN:
 ts.set_token('ZIPLINE_TL_TOKEN')
 """
 
+def get_stock_basics():
+    import tushare as ts
+    return ts.get_stock_basics()
+
 def tushare_bundle(environ,
                   asset_db_writer,
                   minute_bar_writer,
@@ -38,23 +44,62 @@ def tushare_bundle(environ,
                   show_progress,
                   output_dir):
 
-    metadata, histories, symbol_map = get_basic_info()
-    # 写入股票基础信息
+    # 只用代码列表生成基础信息, 不需要先下载行情
+    metadata, symbol_map = get_symbol_metadata(start_session, end_session, show_progress)
+    # 准备写入dailybar, 行情边下载边写入, 内存中最多只有 TUSHARE_PREFETCH 个代码的行情
+    fetcher = HistoryFetcher.from_environ(environ)
+    hist_sids = []
+    daily_bar_writer.write(get_hist_data(symbol_map, fetcher, start_session, end_session, calendar, hist_sids),
+                           show_progress=show_progress)
+    if fetcher.failures:
+        click.echo("获取失败的代码: %s" % ", ".join(sorted(fetcher.failures)))
+    # 写入股票基础信息, 下载失败或没有行情的代码没有日线, 不写入
+    metadata = metadata.loc[hist_sids]
+    symbol_map = symbol_map.loc[hist_sids]
     asset_db_writer.write(metadata)
-    # 准备写入dailybar
-    daily_bar_writer.write(get_hist_data(symbol_map, histories, start_session, end_session), show_progress=show_progress)
     # 送股,分红数据, 从squant 获取
     splits, dividends = zipline_splits_and_dividends(symbol_map)
     adjustment_writer.write(
-        splits=pd.concat(splits, ignore_index=True),
-        dividends=pd.concat(dividends, ignore_index=True),
+        splits=splits,
+        dividends=dividends,
     )
 
-def get_basic_info(show_progress=True):
+def get_symbol_metadata(start_session, end_session, show_progress=True):
+    """
+    根据 tushare 的代码列表生成基础信息, 开始日期为上市日期 (timeToMarket), 结束日期为 end_session,
+    都限制在导入区间内
+    :return: (metadata, symbol_map)
+    """
+    if show_progress:
+        click.echo("获取股票基础信息")
+    ts_symbols = get_stock_basics()
+
+    start_date = start_session.replace(tzinfo=None)
+    end_date = end_session.replace(tzinfo=None)
+    # 未上市的代码 timeToMarket 为 0
+    listed = pd.to_datetime(ts_symbols['timeToMarket'].astype(str), format='%Y%m%d', errors='coerce')
+    df_symbols = pd.DataFrame({
+        'symbol': ts_symbols.index.values,
+        'asset_name': ts_symbols['name'].values,
+        'start_date': np.minimum(np.maximum(listed.fillna(start_date).values, np.datetime64(start_date, 'ns')),
+                                 np.datetime64(end_date, 'ns')),
+        'end_date': end_date,
+    }).sort_values('symbol')
+    symbol_map = pd.DataFrame.copy(df_symbols.symbol)
+
+    # fix the symbol exchange info
+    df = convert_symbols(df_symbols)
+    return df, symbol_map
+
+def get_basic_info(show_progress=True, fetcher=None):
+    """
+    :param fetcher: HistoryFetcher, 默认根据环境变量创建, 并发获取所有代码的历史行情
+    """
+    fetcher = fetcher or HistoryFetcher.from_environ()
     # 先获取列表
     if show_progress:
         click.echo("获取股票基础信息")
-    ts_symbols = ts.get_stock_basics()
+    ts_symbols = get_stock_basics()
     if show_progress:
         click.echo("写入股票列表")
 
@@ -65,57 +110,70 @@ def get_basic_info(show_progress=True):
     # 获取股票数据
     i = 0
     total = len(ts_symbols)
-    for index, row in ts_symbols.iterrows():
+    names = ts_symbols['name']
+    for index, history in fetcher.fetch(ts_symbols.index):
         i = i +1
-        if i > 10:
-            break
+        if show_progress:
+            click.echo("已获取代码%s(%s)的历史行情信息 (%d/%d)" % (index, names[index], i, total))
+        # 没有行情或者重试后仍然失败
+        if history is None or len(history) == 0:
+            continue
 
         srow = {}
         # 获取历史报价信息
-        click.echo("正在获取代码%s(%s)的历史行情信息 (%d/%d)" % (index, row['name'], i, total))
-        histories[index] = ts.get_hist_data(index)
-        srow['start_date'] = histories[index].index[-1]
-        srow['end_date'] = histories[index].index[0]
+        histories[index] = history
+        srow['start_date'] = history.index.min()
+        srow['end_date'] = history.index.max()
         srow['symbol'] = index
-        srow['asset_name'] = row['name']
+        srow['asset_name'] = names[index]
         symbols.append(srow)
 
+    if fetcher.failures:
+        click.echo("获取失败的代码: %s" % ", ".join(sorted(fetcher.failures)))
+
     df_symbols = pd.DataFrame(data=symbols).sort_values('symbol')
     symbol_map = pd.DataFrame.copy(df_symbols.symbol)
 
     # fix the symbol exchange info
-    df = df_symbols.apply(func=convert_symbol_series, axis=1)
+    df = convert_symbols(df_symbols)
 
 
     return df, histories, symbol_map
 
 
-def symbol_to_exchange(symbol):
-    isymbol = int(symbol)
-    if (isymbol>=600000):
-        return symbol + ".SS", "SSE"
-    else:
-        return symbol + ".SZ", "SZSE"
-
-def convert_symbol_series(s):
-    symbol, e = symbol_to_exchange(s['symbol'])
-    s['symbol'] = symbol
-    s['exchange'] = e
-    return s
-
-def get_hist_data(symbol_map, histories, start_session, end_session):
-    for sid, index in symbol_map.iteritems():
-        history = histories[index]
-
-        """
-        writer needs format with
-        [index], open, close, high, low, volume
+def symbols_to_exchange(symbols):
+    """
+    根据代码判断交易所, 600000 及以上为上交所, 其他为深交所
+    :param symbols: 6 位代码数组, 如 ['000001', '600000']
+    :return: (symbols, exchanges), 如 (['000001.SZ', '600000.SS'], ['SZSE', 'SSE'])
+    """
+    symbols = np.asarray(symbols, dtype=str)
+    sse = symbols.astype(np.int64) >= 600000
+    return np.char.add(symbols, np.where(sse, '.SS', '.SZ')), np.where(sse, 'SSE', 'SZSE')
 
-        so we do not need to change the format from tushare
+def convert_symbols(df_symbols):
+    """
+    给 symbol 加上交易所后缀, 并增加 exchange 列
+    """
+    df = df_symbols.copy()
+    df['symbol'], df['exchange'] = symbols_to_exchange(df['symbol'].values)
+    return df
 
-        but we need resort it
-        """
-        yield sid, history.sort_index()
+def get_hist_data(symbol_map, fetcher, start_session, end_session, calendar, hist_sids=None):
+    """
+    按 symbol_map 的顺序下载并产生每个代码对齐到交易日的行情, 下载失败或没有行情的代码跳过
+    writer 需要 open, high, low, close, volume 列, 交易日索引和映射只计算一次, 见 SessionAligner
+    :param fetcher: HistoryFetcher
+    :param hist_sids: list, 不为 None 时追加产生了行情的 sid
+    """
+    aligner = SessionAligner(calendar.sessions_in_range(start_session, end_session))
+    for (sid, index), (_, history) in zip(symbol_map.iteritems(), fetcher.fetch(symbol_map.values)):
+        if history is None or len(history) == 0:
+            continue
+
+        if hist_sids is not None:
+            hist_sids.append(sid)
+        yield sid, aligner.align_frame(history)
 
 if __name__ == '__main__':
     df_symbols, histories, symbol_map = get_basic_info()
@@ -1,7 +1,6 @@
 from zipline.data.bundles import register, yahoo_equities
 import requests
 import os
-from pandas_datareader.data import DataReader
 
 """
 For ingest chinese history day bar from Yahoo
@@ -10,6 +9,7 @@ From both Shenzhen And Shanghai Stock Exchange
 """
 
 from .all_stocks import get_all_stocks, get_cache_dir
+from .yahoo_probe import YahooProber
 
 
 def get_all_yahoo_stock_names(cache=True):
@@ -41,7 +41,7 @@ def register_cn_bundle_from_yahoo(name, cache=True):
 
 def check_code(code):
     """
-    XXX: used check_data_reader instead
+    XXX: used YahooProber instead
     :param code:
     :return:
     """
@@ -71,16 +71,10 @@ def check_code(code):
     print('x')
     return False
 
-def check_data_reader(code):
-    try:
-        DataReader(code, 'yahoo')
-    except:
-        print('%s ok!' % code)
-        return False
-    print('%s not ok!' % code)
-    return True
-
-def get_filtered_symbols(cache=True):
+def get_filtered_symbols(cache=True, prober=None):
+    """
+    :param prober: YahooProber, 默认根据环境变量创建, 并发检查每个代码在 yahoo 上是否有行情
+    """
     cache_dir = get_cache_dir()
     file_path = os.path.join(cache_dir, 'symbols.txt')
 
@@ -94,7 +88,13 @@ def get_filtered_symbols(cache=True):
 
     if cache==False:
         print('Check availablity from Yahoo...')
-    filtered_symbols = list(filter(check_data_reader, symbols))
+    prober = prober or YahooProber.from_environ()
+    filtered_symbols = prober.filter(symbols)
+    if prober.errors:
+        # 没有检查完的结果不写入缓存, 下次重新检查
+        print('%d symbols failed to check: %s' % (len(prober.errors), ', '.join(sorted(prober.errors))))
+        print('result not cached')
+        return filtered_symbols
     print('cache output to %s' % file_path)
     with open(file_path, 'w') as f:
         f.write("\n".join(filtered_symbols))
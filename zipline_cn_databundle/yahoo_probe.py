@@ -0,0 +1,131 @@
+"""
+并发检查 yahoo 上有没有代码的行情, 用于 yahoo.get_filtered_symbols
+
+    * 只请求 chart 接口最近一天的数据, 不下载完整历史; 200 表示有行情, 404 表示没有这个代码
+    * 线程池并发请求, 共用一个 requests.Session 的连接池, 每个请求有超时
+    * 与 HistoryFetcher 一样用令牌桶限制每秒请求数, 避免触发 429
+    * 429, 5xx 和超时等错误按指数退避重试, 重试后仍然失败的代码视为没有行情, 记录在 errors 中
+    * 每检查 progress_every 个代码输出一次进度和速度
+
+配置可以通过环境变量设置, 见 PROBE_ENVIRON
+"""
+import os
+import time
+
+from .fetcher import TokenBucket, pooled_session
+from .parallel import ordered_thread_imap
+
+# 参数名 => (环境变量, 默认值)
+PROBE_ENVIRON = {
+    'workers': ('YAHOO_PROBE_WORKERS', 16),
+    # 单次请求超时秒数
+    'timeout': ('YAHOO_PROBE_TIMEOUT', 10),
+    # 每秒最多请求数, 包括重试, 0 表示不限制
+    'rate': ('YAHOO_PROBE_RATE', 10),
+    'retries': ('YAHOO_PROBE_RETRIES', 3),
+    'url': ('YAHOO_PROBE_URL', 'https://query1.finance.yahoo.com/v8/finance/chart/%s?range=1d&interval=1d'),
+    # 每检查多少个代码输出一次进度, 0 表示不输出
+    'progress_every': ('YAHOO_PROBE_PROGRESS', 100),
+}
+
+PROBE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_5) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/51.0.2704.103 Safari/537.36',
+}
+
+
+class YahooProber(object):
+
+    def __init__(self, url_template=PROBE_ENVIRON['url'][1], workers=16, timeout=10, rate=10, burst=None,
+                 retries=3, backoff=1.0, progress_every=100, session=None, echo=print, clock=time.time,
+                 sleep=time.sleep):
+        """
+        :param url_template: url_template % code 为检查一个代码的地址
+        :param workers: 并发请求的线程数
+        :param timeout: 单次请求超时秒数
+        :param rate: 每秒最多请求数, 包括重试, 0 表示不限制
+        :param burst: 令牌桶容量, 默认为 rate
+        :param retries: 404 以外的错误的重试次数
+        :param backoff: 第 n 次重试前等待 backoff * 2 ** (n - 1) 秒
+        :param progress_every: 每检查多少个代码调用一次 echo 输出进度, 0 表示不输出
+        """
+        self.url_template = url_template
+        self.workers = max(int(workers), 1)
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst, sleep=sleep)
+        self.retries = int(retries)
+        self.backoff = backoff
+        self.sleep = sleep
+        self.progress_every = progress_every
+        self._session = session
+        self.echo = echo
+        self.clock = clock
+        # 重试后仍然出错的 {代码: 异常或状态码}
+        self.errors = {}
+
+    @classmethod
+    def from_environ(cls, environ=None, **options):
+        """
+        根据 PROBE_ENVIRON 中的环境变量创建, options 中的参数优先
+        """
+        environ = os.environ if environ is None else environ
+        values = dict((name, environ.get(env_name, default)) for name, (env_name, default) in PROBE_ENVIRON.items())
+        values.update(options)
+        return cls(url_template=values['url'],
+                   workers=int(values['workers']),
+                   timeout=float(values['timeout']),
+                   rate=float(values['rate']),
+                   retries=int(values['retries']),
+                   progress_every=int(values['progress_every']))
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = pooled_session(self.workers)
+        return self._session
+
+    def exists(self, code):
+        """
+        :param code: yahoo 代码, 如 600000.SS
+        :return: (code, 是否有行情)
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+            self.bucket.acquire()
+            try:
+                response = self.session.get(self.url_template % code, headers=PROBE_HEADERS, timeout=self.timeout)
+                # 不需要内容, 尽早把连接还给连接池
+                response.close()
+            except Exception as e:
+                error = e
+                continue
+            if response.status_code == 200:
+                return code, True
+            if response.status_code == 404:
+                return code, False
+            error = response.status_code
+        self.errors[code] = error
+        return code, False
+
+    def probe(self, symbols):
+        """
+        并发检查, 按 symbols 的顺序产生 (code, 是否有行情)
+        """
+        symbols = list(symbols)
+        started = self.clock()
+        available = 0
+        for i, (code, ok) in enumerate(ordered_thread_imap(self.exists, ((code,) for code in symbols),
+                                                           threads=self.workers), 1):
+            available += ok
+            if self.progress_every and (i % self.progress_every == 0 or i == len(symbols)):
+                elapsed = max(self.clock() - started, 1e-6)
+                self.echo('checked %d/%d, %d available, %d errors, %.1f symbols/s' % (
+                    i, len(symbols), available, len(self.errors), i / elapsed))
+            yield code, ok
+
+    def filter(self, symbols):
+        """
+        :return: 有行情的代码列表, 顺序与 symbols 相同
+        """
+        return [code for code, ok in self.probe(symbols) if ok]